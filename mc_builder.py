@@ -15,6 +15,11 @@ import shutil
 import random
 import json
 import heapq
+import functools
+import weakref
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
 from pathlib import Path
 from datetime import datetime
 
@@ -152,10 +157,9 @@ _NON_SOLID = {"air", "water", "lava", "torch", "wall_torch", "soul_torch",
 # ============================================
 
 def ensure_deps():
-    """确保 amulet-core 已安装"""
-    try:
-        import amulet
-    except ImportError:
+    """确保 amulet-core 已安装 (只查找模块, 不触发 amulet 的完整导入)"""
+    import importlib.util
+    if importlib.util.find_spec("amulet") is None:
         os.system("pip3 install amulet-core amulet-nbt nbtlib")
 
 def resolve_save_path(name_or_path):
@@ -167,34 +171,359 @@ def resolve_save_path(name_or_path):
         return candidate
     raise FileNotFoundError(f"找不到存档: {name_or_path} (尝试了 {candidate})")
 
-def open_world(save_path, auto_backup=True):
-    """打开 Minecraft 存档, 默认自动备份"""
+def open_world(save_path, auto_backup="lazy"):
+    """打开 Minecraft 存档, 默认自动备份
+    auto_backup: "lazy" (默认) 推迟到保存前, 只备份含已修改区块的 .mca, 未写入就中止时不产生备份;
+    "incremental" 首次写入某区域时立即快照其 .mca (reflink / 硬链接 / 复制, 见 restore_backup);
+    True / "full" 完整复制存档; False 不备份"""
     ensure_deps()
     import amulet
 
     save_path = resolve_save_path(save_path)
-    if auto_backup:
+    backup = None
+    if auto_backup == "lazy":
+        backup = _IncrementalBackup(save_path)
+    elif auto_backup == "incremental":
+        backup = _IncrementalBackup(save_path)
+        backup.snapshot("level.dat")
+        print(f"增量备份目录: {backup.path}")
+    elif auto_backup:
         backup_path = save_path.rstrip("/") + "_backup_" + datetime.now().strftime("%Y%m%d_%H%M%S")
         if not os.path.exists(backup_path):
             shutil.copytree(save_path, backup_path)
             print(f"已自动备份到: {backup_path}")
 
     level = amulet.load_level(save_path)
+    if backup is not None:
+        if auto_backup == "incremental":
+            _session(level).on_dirty = backup.snapshot_chunk
+        # 保存前再按 changed_chunks() 补快照: 直接调用 level.set_version_block 等绕过会话记录的写入也能回滚
+        _install_lazy_backup(level, backup)
     return level
 
+def _install_lazy_backup(level, backup):
+    """包装 level.save: 每次真正写盘前先快照含脏区块的区域文件 (每个文件只在首次保存前备份, 已在清单中的跳过)
+    闭包只经 weakref 引用 level, 不形成引用环, level 不再使用时即可释放"""
+    original_save = type(level).save
+    ref = weakref.ref(level)
+
+    @functools.wraps(original_save)
+    def save(*args, **kwargs):
+        lvl = ref()
+        if lvl is not None:
+            dirty = set(_session(lvl).dirty_chunks)
+            changed = getattr(getattr(lvl, "chunks", None), "changed_chunks", None)
+            if changed is not None:
+                dirty.update(changed())
+            if dirty:
+                before = len(backup.manifest["files"])
+                backup.snapshot("level.dat")
+                for dimension, cx, cz in dirty:
+                    backup.snapshot_chunk(dimension, cx, cz)
+                added = sum(1 for e in list(backup.manifest["files"].values())[before:] if e["existed"])
+                if added:
+                    print(f"已备份即将覆盖的 {added} 个文件到: {backup.path}")
+            return original_save(lvl, *args, **kwargs)
+
+    level.save = save
+
+# ---------- 增量备份 ----------
+# 只快照本次会话将要修改的 .mca 区域文件 (首次写入该区域时), 优先 reflink (写时复制),
+# 与上一次备份相同的文件直接硬链接, 否则普通复制; manifest.json 记录每个文件以便 restore_backup 回滚
+_BACKUP_MANIFEST = "manifest.json"
+_FICLONE = 0x40049409
+
+def _reflink(src, dst):
+    """尝试写时复制克隆: Linux 用 FICLONE (btrfs / xfs), macOS 用 clonefile (APFS), 不支持时返回 False"""
+    if sys.platform == "darwin":
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            if os.path.exists(dst):
+                os.remove(dst)  # clonefile 要求目标不存在
+            return libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0
+        except (OSError, AttributeError):
+            return False
+    try:
+        import fcntl
+        with open(src, "rb") as fs, open(dst, "wb") as fd:
+            fcntl.ioctl(fd.fileno(), _FICLONE, fs.fileno())
+        return True
+    except (ImportError, OSError):
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+def _list_backups(save_path):
+    """某存档的全部备份目录 (按时间从旧到新)"""
+    save_path = save_path.rstrip("/")
+    parent, base = os.path.split(save_path)
+    prefix = base + "_backup_"
+    return [os.path.join(parent, d) for d in sorted(os.listdir(parent or "."))
+            if d.startswith(prefix) and os.path.isdir(os.path.join(parent, d))]
+
+class _IncrementalBackup:
+    """一次会话的增量备份: snapshot(相对路径) 在文件被改写前保存一份"""
+
+    def __init__(self, world_path):
+        self.world_path = world_path.rstrip("/")
+        self.path = self.world_path + "_backup_" + datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.manifest = {
+            "world": self.world_path,
+            "mode": "incremental",
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "files": {},
+        }
+        self._regions = set()
+        # 上一次增量备份: 大小与 mtime 都未变的文件直接硬链接过去
+        self._previous = None
+        for path in reversed(_list_backups(self.world_path)):
+            try:
+                with open(os.path.join(path, _BACKUP_MANIFEST)) as f:
+                    self._previous = (path, json.load(f)["files"])
+                break
+            except (OSError, ValueError, KeyError):
+                continue
+
+    def snapshot(self, rel):
+        """在 rel (相对存档目录) 被改写前备份; 同一文件只备份一次"""
+        if rel in self.manifest["files"]:
+            return
+        src = os.path.join(self.world_path, rel)
+        entry = {"existed": os.path.exists(src)}
+        if entry["existed"]:
+            st = os.stat(src)
+            entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+            dst = os.path.join(self.path, rel)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            prev = self._previous and self._previous[1].get(rel)
+            if (prev and prev.get("existed") and prev.get("size") == st.st_size
+                    and prev.get("mtime_ns") == st.st_mtime_ns
+                    and os.path.exists(os.path.join(self._previous[0], rel))):
+                os.link(os.path.join(self._previous[0], rel), dst)
+                entry["method"] = "hardlink"
+            elif _reflink(src, dst):
+                entry["method"] = "reflink"
+            else:
+                shutil.copy2(src, dst)
+                entry["method"] = "copy"
+        self.manifest["files"][rel] = entry
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, _BACKUP_MANIFEST), "w") as f:
+            json.dump(self.manifest, f, indent=2)
+
+    def snapshot_chunk(self, dimension, cx, cz):
+        """备份区块所在的区域文件 (region / entities / poi 三个目录中的同名 .mca)"""
+        key = (dimension, cx >> 5, cz >> 5)
+        if key in self._regions:
+            return
+        self._regions.add(key)
+        base = os.path.dirname(_region_dir(self.world_path, dimension))
+        fname = f"r.{cx >> 5}.{cz >> 5}.mca"
+        for sub in ("region", "entities", "poi"):
+            self.snapshot(os.path.relpath(os.path.join(base, sub, fname), self.world_path))
+
+def restore_backup(backup, save_path=None):
+    """回滚到备份
+    backup: 备份目录, 或存档名/路径 (此时取该存档最新的备份)
+    增量备份按 manifest 还原被改写的文件、删除会话中新建的文件; 完整备份整体替换存档目录
+    注意: 调用前先关闭该存档 (save_and_close / level.close)"""
+    if "_backup_" not in os.path.basename(backup.rstrip("/")):
+        # 传入的是存档: 取最新备份
+        backups = _list_backups(resolve_save_path(backup))
+        if not backups:
+            raise FileNotFoundError(f"找不到存档的备份: {backup}")
+        backup = backups[-1]
+    manifest_path = os.path.join(backup, _BACKUP_MANIFEST)
+    if not os.path.isfile(manifest_path):
+        # 完整备份 (copytree)
+        save_path = save_path or backup.rstrip("/").rsplit("_backup_", 1)[0]
+        shutil.rmtree(save_path)
+        shutil.copytree(backup, save_path)
+        print(f"已从完整备份还原: {backup} -> {save_path}")
+        return save_path
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    save_path = save_path or manifest["world"]
+    for rel, entry in manifest["files"].items():
+        target = os.path.join(save_path, rel)
+        if entry["existed"]:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # 先删除再复制: 目标可能与其他备份共享硬链接
+            if os.path.exists(target):
+                os.remove(target)
+            shutil.copy2(os.path.join(backup, rel), target)
+        elif os.path.exists(target):
+            os.remove(target)
+    print(f"已从增量备份还原 {len(manifest['files'])} 个文件: {backup} -> {save_path}")
+    return save_path
+
+# ---------- 区块驻留上限 ----------
+
+def _current_rss_mb():
+    """当前进程常驻内存 (MB), 取不到时返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+class ChunkResidency:
+    """长时间会话的区块驻留管理: 包装 level.get_chunk, 按 LRU 记录已载入区块,
+    超过 max_chunks 或常驻内存超过 max_memory_mb 时卸载最久未访问的未修改区块
+    (保留最近访问的一半及所有已修改区块); write_dirty=True 时先保存再卸载, 使峰值内存保持平稳。
+    由 limit_resident_chunks 创建, close() 恢复原 get_chunk。"""
+
+    def __init__(self, level, max_chunks=2048, max_memory_mb=None, write_dirty=False, check_every=64):
+        self.level = level
+        self.max_chunks = max_chunks
+        self.max_memory_mb = max_memory_mb
+        self.write_dirty = write_dirty
+        self.check_every = check_every
+        self.resident = OrderedDict()  # (dim, cx, cz) -> None, 最近访问在末尾
+        self.peak = 0
+        self.evictions = 0
+        self.saves = 0
+        self._limit = max_chunks       # 已修改区块占满上限时临时抬高, 避免每次载入都空转
+        self._calls = 0
+        self._busy = False
+        self._closed = False
+        self._previous = level.__dict__.get("get_chunk")  # 之前安装的包装 (无则为 None)
+        # 闭包不直接持有 level (绑定方法), 避免 level 与包装之间形成引用环
+        previous = self._previous
+        unbound = type(level).get_chunk
+        ref = weakref.ref(self)
+        level_ref = weakref.ref(level)
+
+        def get_chunk(cx, cz, dimension):
+            manager = ref()
+            if manager is not None and not manager._closed:
+                manager._touch((dimension, cx, cz))
+            if previous is not None:
+                return previous(cx, cz, dimension)
+            return unbound(level_ref(), cx, cz, dimension)
+
+        self._wrapper = level.get_chunk = get_chunk
+
+    def _touch(self, key):
+        if key in self.resident:
+            self.resident.move_to_end(key)
+            return
+        if not self._busy:
+            self._calls += 1
+            over = len(self.resident) >= self._limit
+            if not over and self.max_memory_mb and self._calls % self.check_every == 0:
+                rss = _current_rss_mb()
+                over = rss is not None and rss > self.max_memory_mb
+            if over:
+                self.evict()
+        self.resident[key] = None
+        self.peak = max(self.peak, len(self.resident))
+
+    def _unsaved(self):
+        """已修改且未保存的区块"""
+        changed = getattr(getattr(self.level, "chunks", None), "changed_chunks", None)
+        return set(changed()) if changed is not None else set(_session(self.level).dirty_chunks)
+
+    def _safe_area(self, dirty):
+        """保留区 (dim, min_cx, min_cz, max_cx, max_cz): 覆盖全部未保存区块,
+        再按最近访问顺序纳入区块, 直到面积达到 max_chunks 的一半; 跨维度或为空时返回 None"""
+        dims = {key[0] for key in dirty}
+        if len(dims) > 1 or not (dirty or self.resident):
+            return None
+        dimension = dims.pop() if dims else next(reversed(self.resident))[0]
+        box = None
+        for _, cx, cz in dirty:
+            box = _grow_box(box, cx, cz)
+        budget = max(self.max_chunks // 2, _box_area(box))
+        for key in reversed(self.resident):
+            if key[0] == dimension:
+                grown = _grow_box(box, key[1], key[2])
+                if _box_area(grown) <= budget:
+                    box = grown
+        return (dimension,) + box if box is not None else None
+
+    def evict(self):
+        """卸载最久未访问的未修改区块; 新区块载入前调用, 不会丢弃正在修改的区块"""
+        self._busy = True
+        try:
+            dirty = self._unsaved()
+            if self.write_dirty and dirty:
+                self.level.save()
+                self.saves += 1
+                dirty = set()
+            area = self._safe_area(dirty)
+            unload = getattr(self.level, "unload", None)
+            if area is not None and unload is not None:
+                # 保留区之外的区块全部卸载 (其中没有未保存的修改)
+                unload(safe_area=area)
+                dimension, x1, z1, x2, z2 = area
+                survivors = [key for key in self.resident
+                             if key[0] == dimension and x1 <= key[1] <= x2 and z1 <= key[2] <= z2]
+            else:
+                self.level.unload_unchanged()
+                survivors = [key for key in self.resident if key in dirty]
+            self.evictions += len(self.resident) - len(survivors)
+            self.resident = OrderedDict((key, None) for key in survivors)
+            if len(self.resident) > self.max_chunks // 2:
+                # 未保存区块占满保留区: 阈值翻倍, 避免每次载入都重复扫描
+                if self._limit == self.max_chunks:
+                    print(f"  警告: {len(dirty)} 个已修改区块未保存, 无法卸载; "
+                          f"需要 write_dirty=True 才能继续限制内存")
+                self._limit = len(self.resident) + max(self.max_chunks // 2, len(self.resident), 1)
+            else:
+                self._limit = self.max_chunks
+        finally:
+            self._busy = False
+
+    def stats(self):
+        """{resident, peak, evictions, saves, rss_mb}"""
+        return {
+            "resident": len(self.resident),
+            "peak": self.peak,
+            "evictions": self.evictions,
+            "saves": self.saves,
+            "rss_mb": _current_rss_mb(),
+        }
+
+    def close(self):
+        """恢复安装前的 get_chunk; 之后若又被其他包装覆盖, 则只停用本管理器"""
+        self._closed = True
+        if self.level.__dict__.get("get_chunk") is self._wrapper:
+            if self._previous is None:
+                del self.level.get_chunk
+            else:
+                self.level.get_chunk = self._previous
+
+def _grow_box(box, cx, cz):
+    if box is None:
+        return cx, cz, cx, cz
+    return min(box[0], cx), min(box[1], cz), max(box[2], cx), max(box[3], cz)
+
+def _box_area(box):
+    return 0 if box is None else (box[2] - box[0] + 1) * (box[3] - box[1] + 1)
+
+def limit_resident_chunks(level, max_chunks=2048, max_memory_mb=None, write_dirty=False):
+    """为长时间会话设置区块驻留上限, 返回 ChunkResidency (可调用 stats() / close())
+    max_chunks: 驻留区块数上限 (LRU); max_memory_mb: 常驻内存上限 (仅 Linux 可读当前 RSS)
+    write_dirty: 超限时先保存已修改的区块再卸载 (会提前写盘, 自动备份仍在写盘前进行)"""
+    level = _unwrap_level(level)
+    manager = ChunkResidency(level, max_chunks, max_memory_mb, write_dirty)
+    print(f"区块驻留上限: {max_chunks} 个区块"
+          f"{f', {max_memory_mb} MB' if max_memory_mb else ''}{', 超限时写出已修改区块' if write_dirty else ''}")
+    return manager
+
 def save_and_close(level):
     """保存并关闭存档"""
     level.save()
     level.close()
 
-def detect_version(level):
-    """从 level.dat 自动检测游戏版本, 返回 amulet 版本元组"""
-    import nbtlib
-    level_path = os.path.join(level.level_wrapper.path, "level.dat")
-    nbt = nbtlib.load(level_path)
-    data = nbt["Data"]
+_DIMENSION_IDS = {0: "minecraft:overworld", -1: "minecraft:the_nether", 1: "minecraft:the_end"}
+
+def _version_from_data_version(dv):
+    """DataVersion -> amulet 版本元组"""
     # DataVersion: 1.21=3953, 1.20.4=3700, 1.20=3463, 1.19=3105
-    dv = int(data.get("DataVersion", 3953))
     if dv >= 3953:
         return ("java", (1, 21, 0))
     elif dv >= 3463:
@@ -206,14 +535,11 @@ def detect_version(level):
     else:
         return ("java", (1, 17, 0))
 
-def get_player_pos(level):
-    """从 level.dat 读取玩家位置和维度"""
-    import nbtlib
-    level_path = os.path.join(level.level_wrapper.path, "level.dat")
-    nbt = nbtlib.load(level_path)
-    player = nbt["Data"]["Player"]
+def _player_entry(player):
+    """玩家 NBT -> {x, y, z, dimension}"""
     pos = player["Pos"]
-    dim = str(player.get("Dimension", "minecraft:overworld"))
+    dim = player.get("Dimension", "minecraft:overworld")
+    dim = _DIMENSION_IDS.get(int(dim), "minecraft:overworld") if isinstance(dim, int) else str(dim)
     return {
         "x": int(float(pos[0])),
         "y": int(float(pos[1])),
@@ -221,16 +547,254 @@ def get_player_pos(level):
         "dimension": dim,
     }
 
-def quick_setup(save_name, auto_backup=True):
+class WorldInfo:
+    """level.dat 的一次解析结果 (按存档路径 + level.dat mtime 缓存, 见 world_info)
+
+    data_version / version: DataVersion 与对应的 amulet 版本元组
+    player: 单人存档玩家 {x, y, z, dimension}, 多人存档为 None
+    spawn: 出生点 (x, y, z); game_rules: {规则名: 字符串值}; world_border: 世界边界参数
+    players: playerdata/ 中各玩家 {uuid: {x, y, z, dimension}}, 首次访问时读取"""
+
+    def __init__(self, path):
+        import nbtlib
+
+        self.path = path
+        data = nbtlib.load(os.path.join(path, "level.dat"))["Data"]
+        self.level_name = str(data.get("LevelName", os.path.basename(path)))
+        self.data_version = int(data.get("DataVersion", 3953))
+        self.version = _version_from_data_version(self.data_version)
+        self.player = _player_entry(data["Player"]) if "Player" in data else None
+        self.spawn = (int(data.get("SpawnX", 0)), int(data.get("SpawnY", 64)), int(data.get("SpawnZ", 0)))
+        self.game_rules = {str(k): str(v) for k, v in data.get("GameRules", {}).items()}
+        self.world_border = {
+            "center": (float(data.get("BorderCenterX", 0.0)), float(data.get("BorderCenterZ", 0.0))),
+            "size": float(data.get("BorderSize", 59999968.0)),
+            "damage_per_block": float(data.get("BorderDamagePerBlock", 0.2)),
+            "safe_zone": float(data.get("BorderSafeZone", 5.0)),
+            "warning_blocks": float(data.get("BorderWarningBlocks", 5.0)),
+        }
+        self._players = None
+
+    @property
+    def players(self):
+        if self._players is None:
+            import nbtlib
+
+            self._players = {}
+            directory = os.path.join(self.path, "playerdata")
+            if os.path.isdir(directory):
+                for fname in sorted(os.listdir(directory)):
+                    if not fname.endswith(".dat"):
+                        continue
+                    try:
+                        self._players[fname[:-4]] = _player_entry(nbtlib.load(os.path.join(directory, fname)))
+                    except (OSError, KeyError, ValueError):
+                        continue
+        return self._players
+
+    def player_pos(self):
+        """单人存档取 level.dat 中的玩家; 多人存档取 playerdata 中第一个玩家, 都没有时用出生点"""
+        if self.player is not None:
+            return dict(self.player)
+        for entry in self.players.values():
+            return dict(entry)
+        x, y, z = self.spawn
+        return {"x": x, "y": y, "z": z, "dimension": "minecraft:overworld"}
+
+_WORLD_INFO = {}
+
+def world_info(level_or_path):
+    """获取存档的 WorldInfo: 传入 level 或存档名/路径; level.dat 未变化时直接返回缓存"""
+    if isinstance(level_or_path, (str, os.PathLike)):
+        path = resolve_save_path(str(level_or_path))
+    else:
+        path = _unwrap_level(level_or_path).level_wrapper.path
+    path = os.path.abspath(path)
+    mtime = os.stat(os.path.join(path, "level.dat")).st_mtime_ns
+    cached = _WORLD_INFO.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = _WORLD_INFO[path] = (mtime, WorldInfo(path))
+    return cached[1]
+
+def detect_version(level):
+    """从 level.dat 自动检测游戏版本, 返回 amulet 版本元组"""
+    return world_info(level).version
+
+def get_player_pos(level):
+    """从 level.dat 读取玩家位置和维度 (多人存档读取 playerdata)"""
+    return world_info(level).player_pos()
+
+def quick_setup(save_name, auto_backup="lazy"):
     """一键初始化: 打开存档 + 获取玩家位置 + 检测版本
     返回 (level, player, dim, ver)"""
-    level = open_world(save_name, auto_backup)
-    player = get_player_pos(level)
-    ver = detect_version(level)
+    info = world_info(save_name)
+    level = open_world(info.path, auto_backup)
+    player = info.player_pos()
+    ver = info.version
     dim = player["dimension"]
     print(f"玩家位置: ({player['x']}, {player['y']}, {player['z']}) 维度: {dim} 版本: {ver[1]}")
     return level, player, dim, ver
 
+class _Session:
+    """一个已打开存档在本次会话中的状态 (按 level 对象保存)"""
+
+    def __init__(self):
+        self.dirty_chunks = set()  # 本次会话写过的 (dim, cx, cz), 磁盘上的 Heightmaps 已过期
+        self.written = {}          # (dim, sx, sy, sz) -> bytearray(4096), 本次会话写过的位置 (fix_connections 用)
+        self.on_dirty = None       # 区块首次变脏时回调 (dim, cx, cz), 增量备份用
+
+    def mark_dirty(self, dimension, cx, cz):
+        key = (dimension, cx, cz)
+        if key not in self.dirty_chunks:
+            if self.on_dirty is not None:
+                self.on_dirty(dimension, cx, cz)
+            self.dirty_chunks.add(key)
+
+    def record(self, dimension, x, y, z):
+        """记录一次方块写入"""
+        key = (dimension, x >> 4, y >> 4, z >> 4)
+        mask = self.written.get(key)
+        if mask is None:
+            mask = self.written[key] = bytearray(4096)
+            self.mark_dirty(dimension, x >> 4, z >> 4)
+        mask[(x & 15) << 8 | (y & 15) << 4 | (z & 15)] = 1
+
+    def record_many(self, dimension, xs, ys, zs):
+        """批量记录写入 (xs/ys/zs 为 int64 数组)"""
+        import numpy as np
+
+        local = (xs & 15) << 8 | (ys & 15) << 4 | (zs & 15)
+        for (sx, sy, sz), part in _group_by_section(xs, ys, zs, local):
+            key = (dimension, sx, sy, sz)
+            mask = self.written.get(key)
+            if mask is None:
+                mask = self.written[key] = bytearray(4096)
+                self.mark_dirty(dimension, sx, sz)
+            np.frombuffer(mask, dtype=np.uint8)[part] = 1
+
+    def record_box(self, dimension, min_x, min_y, min_z, max_x, max_y, max_z):
+        """记录整个长方体被写入 (按子区块切片置位)"""
+        import numpy as np
+
+        for sx in range(min_x >> 4, (max_x >> 4) + 1):
+            ax, bx = max(min_x, sx * 16) - sx * 16, min(max_x, sx * 16 + 15) - sx * 16 + 1
+            for sz in range(min_z >> 4, (max_z >> 4) + 1):
+                az, bz = max(min_z, sz * 16) - sz * 16, min(max_z, sz * 16 + 15) - sz * 16 + 1
+                for sy in range(min_y >> 4, (max_y >> 4) + 1):
+                    ay, by = max(min_y, sy * 16) - sy * 16, min(max_y, sy * 16 + 15) - sy * 16 + 1
+                    key = (dimension, sx, sy, sz)
+                    mask = self.written.get(key)
+                    if mask is None:
+                        mask = self.written[key] = bytearray(4096)
+                        self.mark_dirty(dimension, sx, sz)
+                    np.frombuffer(mask, dtype=np.uint8).reshape(16, 16, 16)[ax:bx, ay:by, az:bz] = 1
+
+_SESSIONS = weakref.WeakKeyDictionary()
+
+def _session(level):
+    state = _SESSIONS.get(level)
+    if state is None:
+        state = _SESSIONS[level] = _Session()
+    return state
+
+# ============================================
+# 核心: 区域文件 (.mca) 直接读取
+# ============================================
+
+def _region_dir(world_path, dimension):
+    """维度 -> region 目录"""
+    if dimension == "minecraft:overworld":
+        return os.path.join(world_path, "region")
+    if dimension == "minecraft:the_nether":
+        return os.path.join(world_path, "DIM-1", "region")
+    if dimension == "minecraft:the_end":
+        return os.path.join(world_path, "DIM1", "region")
+    namespace, name = dimension.split(":", 1)
+    return os.path.join(world_path, "dimensions", namespace, name, "region")
+
+class _RegionReader:
+    """按需读取 r.X.Z.mca 中单个区块的原始 NBT (nbtlib), 区域文件头只读一次"""
+
+    def __init__(self, world_path, dimension):
+        self.directory = _region_dir(world_path, dimension)
+        self._headers = {}
+
+    def read_chunk(self, cx, cz):
+        """返回区块根 Compound, 区块不存在或无法解析时返回 None"""
+        import io
+        import gzip
+        import zlib
+        import nbtlib
+
+        rx, rz = cx >> 5, cz >> 5
+        path = os.path.join(self.directory, f"r.{rx}.{rz}.mca")
+        header = self._headers.get((rx, rz))
+        if header is None:
+            if not os.path.exists(path):
+                return None
+            with open(path, "rb") as f:
+                header = self._headers[(rx, rz)] = f.read(4096)
+        i = 4 * ((cx & 31) + (cz & 31) * 32)
+        if len(header) < i + 4:
+            return None
+        sector = int.from_bytes(header[i:i + 3], "big")
+        if sector == 0:
+            return None
+        with open(path, "rb") as f:
+            f.seek(sector * 4096)
+            length = int.from_bytes(f.read(4), "big")
+            compression = f.read(1)[0]
+            data = f.read(length - 1)
+        if compression == 1:
+            data = gzip.decompress(data)
+        elif compression == 2:
+            data = zlib.decompress(data)
+        elif compression != 3:
+            return None  # lz4 / 外部 .mcc 文件: 交给方块扫描
+        try:
+            return nbtlib.File.parse(io.BytesIO(data))
+        except Exception:
+            return None
+
+# 存储的高度图要求 1.16+ 的非跨 long 打包格式
+_HEIGHTMAP_MIN_DATA_VERSION = 2566
+
+def _unpack_heightmap(longs):
+    """解码 256 个 long 打包的高度值, 返回 [x, z] 的 int 数组"""
+    import numpy as np
+
+    longs = np.asarray(longs, dtype=np.int64).view(np.uint64)
+    bits = next((b for b in range(1, 33) if -(-256 // (64 // b)) == len(longs)), None)
+    if bits is None:
+        return None
+    per_long = 64 // bits
+    i = np.arange(256)
+    values = (longs[i // per_long] >> ((i % per_long) * bits).astype(np.uint64)) & np.uint64((1 << bits) - 1)
+    return values.astype(np.int32).reshape(16, 16).T  # 存储顺序为 x + z*16
+
+def _stored_heightmaps(reader, cx, cz):
+    """读取区块 NBT 中的 Heightmaps, 返回 {类型: [x,z] 最高方块 y (无方块为 min_y-1)}
+    区块不存在、未生成完成或缺少所需高度图时返回 None"""
+    root = reader.read_chunk(cx, cz) if reader is not None else None
+    if root is None:
+        return None
+    if int(root.get("DataVersion", 0)) < _HEIGHTMAP_MIN_DATA_VERSION:
+        return None
+    data = root.get("Level", root)  # 1.18 之前包在 Level 下
+    if str(data.get("Status", "")).replace("minecraft:", "") != "full":
+        return None
+    min_y = int(data["yPos"]) * 16 if "yPos" in data else 0
+    stored = data.get("Heightmaps", {})
+    result = {}
+    for kind in ("WORLD_SURFACE", "OCEAN_FLOOR", "MOTION_BLOCKING"):
+        if kind not in stored:
+            return None
+        values = _unpack_heightmap(stored[kind])
+        if values is None:
+            return None
+        result[kind] = values + (min_y - 1)
+    return result
+
 # ============================================
 # 核心: 方块放置
 # ============================================
@@ -239,18 +803,78 @@ def _fix_block_name(name):
     """自动纠正常见方块名错误"""
     return BLOCK_ALIASES.get(name, name)
 
-def place_block(level, x, y, z, dimension, game_version, block_name, properties=None):
-    """放置单个方块"""
-    import amulet
-    from amulet.api.block import Block
+# Block 驻留缓存上限 (不同方块状态数)
+BLOCK_CACHE_SIZE = 4096
+
+class _BlockCache:
+    """有界 Block 驻留缓存: 每个 (方块名, 属性, 版本) 只构造一个共享的 Block 实例
+    超出上限时按 LRU 淘汰, hits/misses 记录命中情况"""
+
+    def __init__(self, maxsize=BLOCK_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+
+    def get(self, block_name, properties, game_version):
+        key = (block_name, frozenset(properties.items()) if properties else None, game_version)
+        block = self._blocks.get(key)
+        if block is not None:
+            self.hits += 1
+            self._blocks.move_to_end(key)
+            return block
+        self.misses += 1
+        block = self._build(block_name, properties)
+        self._blocks[key] = block
+        if len(self._blocks) > self.maxsize:
+            self._blocks.popitem(last=False)
+        return block
+
+    @staticmethod
+    def _build(block_name, properties):
+        import amulet
+        from amulet.api.block import Block
+
+        props = {}
+        if properties:
+            for k, v in properties.items():
+                props[k] = amulet.StringTag(str(v))
+        # 模板中非 minecraft 的方块名带命名空间前缀 ("mod:name")
+        namespace, _, base_name = block_name.rpartition(":")
+        return Block(namespace or "minecraft", _fix_block_name(base_name), props)
+
+    def clear(self):
+        self._blocks.clear()
+        self.hits = 0
+        self.misses = 0
+
+_BLOCK_CACHE = _BlockCache()
+
+def get_block_cache_stats():
+    """返回 Block 缓存统计: {hits, misses, size, maxsize, hit_rate}"""
+    c = _BLOCK_CACHE
+    total = c.hits + c.misses
+    return {
+        "hits": c.hits,
+        "misses": c.misses,
+        "size": len(c._blocks),
+        "maxsize": c.maxsize,
+        "hit_rate": c.hits / total if total else 0.0,
+    }
 
-    block_name = _fix_block_name(block_name)
-    props = {}
-    if properties:
-        for k, v in properties.items():
-            props[k] = amulet.StringTag(str(v))
-    block = Block("minecraft", block_name, props)
+def clear_block_cache(maxsize=None):
+    """清空 Block 缓存并重置计数, 可同时调整上限"""
+    _BLOCK_CACHE.clear()
+    if maxsize is not None:
+        _BLOCK_CACHE.maxsize = maxsize
+
+def place_block(level, x, y, z, dimension, game_version, block_name, properties=None):
+    """放置单个方块 (Block 实例来自驻留缓存)"""
+    block = _BLOCK_CACHE.get(block_name, properties, game_version)
     level.set_version_block(x, y, z, dimension, game_version, block)
+    if not isinstance(level, BuildPlan):
+        # 计划模式由 apply() 在真正写入时记录
+        _session(level).record(dimension, x, y, z)
 
 def get_block(level, x, y, z, dimension, game_version):
     """读取指定位置的方块, 返回 base_name (如 'grass_block', 'air')"""
@@ -262,6 +886,117 @@ def get_block_full(level, x, y, z, dimension, game_version):
     block, _ = level.get_version_block(x, y, z, dimension, game_version)
     return f"{block.namespace}:{block.base_name}"
 
+# ---------- 区块优先调度 ----------
+
+def _chunk_major_order(xs, ys, zs):
+    """按 (cx, cz) -> cy -> 子区块内 x/z/y 排序的下标; 稳定排序, 同一坐标保持原先后顺序"""
+    import numpy as np
+    return np.lexsort((ys & 15, zs & 15, xs & 15, ys >> 4, zs >> 4, xs >> 4))
+
+def _chunk_loads(xs, zs):
+    """按给定顺序访问时切换区块的次数 (相邻两次落在不同区块即计一次载入)"""
+    import numpy as np
+    if not len(xs):
+        return 0
+    key = (xs >> 4) * (1 << 32) + (zs >> 4)
+    return int(np.count_nonzero(key[1:] != key[:-1])) + 1
+
+def place_blocks(level, writes, dim, ver):
+    """批量放置方块, 先按区块优先顺序重排再执行
+    writes: [(x, y, z, block_name), ...] 或 (x, y, z, block_name, props); 同一坐标后写覆盖先写
+    打印重排前后的区块切换次数, 返回实际写入数"""
+    import numpy as np
+
+    states = {}
+    names = []
+    coords = []
+    sids = []
+    for w in writes:
+        props = w[4] if len(w) > 4 else None
+        key = (w[3], frozenset(props.items()) if props else None)
+        sid = states.get(key)
+        if sid is None:
+            sid = states[key] = len(names)
+            names.append((w[3], props))
+        coords.append(w[:3])
+        sids.append(sid)
+    if not coords:
+        return 0
+    xs, ys, zs = (np.asarray(a, dtype=np.int64) for a in zip(*coords))
+    sids = np.asarray(sids, dtype=np.int64)
+    before = _chunk_loads(xs, zs)
+
+    # 只保留每个坐标的最后一次写入, 之后按状态分组写入也不会改变结果
+    _, last = np.unique(np.stack([xs, ys, zs], axis=1)[::-1], axis=0, return_index=True)
+    keep = np.sort(len(xs) - 1 - last)
+    xs, ys, zs, sids = xs[keep], ys[keep], zs[keep], sids[keep]
+    order = _chunk_major_order(xs, ys, zs)
+    xs, ys, zs, sids = xs[order], ys[order], zs[order], sids[order]
+    print(f"  区块调度: {len(coords)} 次写入, 区块切换 {before} -> {_chunk_loads(xs, zs)} 次")
+
+    if isinstance(level, BuildPlan):
+        for x, y, z, sid in zip(xs.tolist(), ys.tolist(), zs.tolist(), sids.tolist()):
+            place_block(level, x, y, z, dim, ver, *names[sid])
+        return len(xs)
+    writer = level if isinstance(level, BlockWriter) else BlockWriter(level)
+    for sid, (name, props) in enumerate(names):
+        sel = sids == sid
+        if sel.any():
+            writer.set_many(xs[sel], ys[sel], zs[sel], dim, ver, _BLOCK_CACHE.get(name, props, ver))
+    if writer is not level:
+        writer.flush()
+    return len(xs)
+
+def get_blocks(level, positions, dim, ver, full=False):
+    """批量读取方块名 (顺序与 positions 一致), 内部按区块优先顺序读取:
+    每个区块只取一次, 子区块内向量化取值, 每种方块状态只翻译一次
+    full: 返回 'minecraft:xxx' 完整名称"""
+    import numpy as np
+    from amulet.api.errors import ChunkDoesNotExist, ChunkLoadError
+
+    positions = list(positions)
+    if not positions:
+        return []
+    level = _unwrap_level(level)
+    version = level.translation_manager.get_version(*ver)
+    xs, ys, zs = (np.asarray(a, dtype=np.int64) for a in zip(*positions))
+    order = _chunk_major_order(xs, ys, zs)
+    print(f"  区块调度: {len(positions)} 次读取, 区块切换 {_chunk_loads(xs, zs)} -> "
+          f"{_chunk_loads(xs[order], zs[order])} 次")
+
+    air = "minecraft:air" if full else "air"
+    result = [air] * len(positions)
+    names = {}  # universal Block -> 名称
+    ox, oy, oz = xs[order], ys[order], zs[order]
+    ckey = (ox >> 4) * (1 << 32) + (oz >> 4)
+    starts = np.flatnonzero(np.r_[True, ckey[1:] != ckey[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+    for a, b in zip(starts.tolist(), ends.tolist()):
+        cx, cz = int(ox[a] >> 4), int(oz[a] >> 4)
+        try:
+            chunk = level.get_chunk(cx, cz, dim)
+        except (ChunkDoesNotExist, ChunkLoadError):
+            continue
+        present = set(chunk.blocks.sub_chunks)
+        cy = oy[a:b] >> 4
+        for sy in np.unique(cy).tolist():
+            if sy not in present:
+                continue
+            sel = np.flatnonzero(cy == sy) + a
+            rids = chunk.blocks.get_sub_chunk(sy)[ox[sel] & 15, oy[sel] & 15, oz[sel] & 15]
+            for rid, i in zip(rids.tolist(), order[sel].tolist()):
+                ublock = chunk.block_palette[rid]
+                name = names.get(ublock)
+                if name is None:
+                    block = version.block.from_universal(ublock)[0]
+                    if not hasattr(block, "base_name"):
+                        name = air
+                    else:
+                        name = f"{block.namespace}:{block.base_name}" if full else block.base_name
+                    names[ublock] = name
+                result[i] = name
+    return result
+
 def _is_solid_for_connection(block_name):
     """判断方块是否为"实心"（fence/pane/wall 可以连接到它）"""
     if block_name in _NON_SOLID:
@@ -278,122 +1013,1038 @@ def _is_solid_for_connection(block_name):
     # 默认认为是实心
     return block_name != "air"
 
-def update_connections(level, x1, z1, x2, z2, dim, ver, y1=None, y2=None):
-    """后处理: 修复区域内所有 fence/glass_pane/wall/iron_bars 的连接属性
-    在建筑完成后调用一次即可。
-    y1/y2: y 范围, 默认 0~255"""
-    import amulet
-    from amulet.api.block import Block
+def _connection_updates(view, region=None):
+    """向量化计算 view 内可连接方块的新属性
+    region: 需要重新计算的位置 (与 view 同形状的 bool 数组), None 表示全部
+    view 最外一圈 (x/z 两侧和上方) 只作为邻居使用
+    返回 [(x, y, z, name, new_props)], 只包含属性有变化的方块"""
+    import numpy as np
+
+    idx = view.indices
+    solid = view.lookup(_is_solid_for_connection)[idx]
+    is_wall = view.lookup(_CONNECTABLE_WALL)
+    candidates = (view.lookup(_CONNECTABLE_BOOL) | is_wall)[idx]
+    if region is not None:
+        candidates &= region
+    candidates[0], candidates[-1] = False, False
+    candidates[:, :, 0], candidates[:, :, -1] = False, False
+    candidates[:, -1] = False
+
+    # 邻居实心掩码 -> 每个位置 5 位编码: north/south/west/east/above
+    code = np.zeros(idx.shape, dtype=np.uint32)
+    code[:, :, 1:] |= solid[:, :, :-1]                      # north (z-1)
+    code[:, :, :-1] |= solid[:, :, 1:].astype(np.uint32) << 1  # south (z+1)
+    code[1:] |= solid[:-1].astype(np.uint32) << 2            # west (x-1)
+    code[:-1] |= solid[1:].astype(np.uint32) << 3            # east (x+1)
+    code[:, :-1] |= solid[:, 1:].astype(np.uint32) << 4      # above (y+1)
+
+    positions = np.argwhere(candidates)
+    if not len(positions):
+        return []
+    keys = idx[candidates].astype(np.int64) * 32 + code[candidates]
+    uniq, inverse = np.unique(keys, return_inverse=True)
+
+    updates = []
+    for u, key in enumerate(uniq.tolist()):
+        block = view.blocks[key >> 5]
+        n, s, w, e, above = ((key >> b) & 1 for b in range(5))
+        old_props = {}
+        if hasattr(block, 'properties'):
+            for k, v in block.properties.items():
+                old_props[k] = str(v)
+        new_props = dict(old_props)
+        if not is_wall[key >> 5]:
+            for side, on in (("north", n), ("south", s), ("west", w), ("east", e)):
+                new_props[side] = "true" if on else "false"
+        else:
+            # 连接到实心方块或同类墙时默认 low
+            for side, on in (("north", n), ("south", s), ("west", w), ("east", e)):
+                new_props[side] = "low" if on else "none"
+            # up: 有方块在上方、或是拐角/末端/T字形时为 true
+            is_straight = (n and s and not e and not w) or (e and w and not n and not s)
+            new_props["up"] = "true" if above or not is_straight else "false"
+        if new_props == old_props:
+            continue
+        for i, j, k in positions[inverse.reshape(-1) == u].tolist():
+            updates.append((view.min_x + i, view.min_y + j, view.min_z + k, block.base_name, new_props))
+    return updates
 
+def update_connections(level, x1, z1, x2, z2, dim, ver, y1=None, y2=None):
+    """后处理: 修复区域内所有 fence/glass_pane/wall/iron_bars 的连接属性 (全区域模式)
+    y1/y2: y 范围, 默认 0~255
+    只修复本次会话改动过的方块请用 fix_connections"""
     min_x, max_x = min(x1, x2), max(x1, x2)
     min_z, max_z = min(z1, z2), max(z1, z2)
     min_y = y1 if y1 is not None else 0
     max_y = y2 if y2 is not None else 255
-    count = 0
 
-    for x in range(min_x, max_x + 1):
-        for z in range(min_z, max_z + 1):
-            for y in range(min_y, max_y + 1):
-                bid = get_block(level, x, y, z, dim, ver)
-
-                if bid in _CONNECTABLE_BOOL:
-                    # 读取当前方块的其他属性 (waterlogged 等)
-                    block, _ = level.get_version_block(x, y, z, dim, ver)
-                    old_props = {}
-                    if hasattr(block, 'properties'):
-                        for k, v in block.properties.items():
-                            old_props[k] = str(v)
-
-                    # 检查四个方向邻居
-                    n_north = get_block(level, x, y, z - 1, dim, ver)
-                    n_south = get_block(level, x, y, z + 1, dim, ver)
-                    n_west = get_block(level, x - 1, y, z, dim, ver)
-                    n_east = get_block(level, x + 1, y, z, dim, ver)
-
-                    new_props = dict(old_props)
-                    new_props["north"] = "true" if _is_solid_for_connection(n_north) else "false"
-                    new_props["south"] = "true" if _is_solid_for_connection(n_south) else "false"
-                    new_props["west"] = "true" if _is_solid_for_connection(n_west) else "false"
-                    new_props["east"] = "true" if _is_solid_for_connection(n_east) else "false"
-
-                    tag_props = {}
-                    for k, v in new_props.items():
-                        tag_props[k] = amulet.StringTag(str(v))
-                    new_block = Block("minecraft", bid, tag_props)
-                    level.set_version_block(x, y, z, dim, ver, new_block)
-                    count += 1
-
-                elif bid in _CONNECTABLE_WALL:
-                    block, _ = level.get_version_block(x, y, z, dim, ver)
-                    old_props = {}
-                    if hasattr(block, 'properties'):
-                        for k, v in block.properties.items():
-                            old_props[k] = str(v)
-
-                    n_north = get_block(level, x, y, z - 1, dim, ver)
-                    n_south = get_block(level, x, y, z + 1, dim, ver)
-                    n_west = get_block(level, x - 1, y, z, dim, ver)
-                    n_east = get_block(level, x + 1, y, z, dim, ver)
-                    n_above = get_block(level, x, y + 1, z, dim, ver)
-
-                    def wall_side(neighbor):
-                        if not _is_solid_for_connection(neighbor):
-                            return "none"
-                        if neighbor in _CONNECTABLE_WALL:
-                            return "low"
-                        return "low"  # 连接到实心方块时默认 low
-
-                    new_props = dict(old_props)
-                    new_props["north"] = wall_side(n_north)
-                    new_props["south"] = wall_side(n_south)
-                    new_props["west"] = wall_side(n_west)
-                    new_props["east"] = wall_side(n_east)
-
-                    # up: 有方块在上方、或是拐角/末端/T字形时为 true
-                    sides_connected = sum(1 for d in ["north","south","east","west"]
-                                          if new_props[d] != "none")
-                    is_straight_ns = (new_props["north"] != "none" and new_props["south"] != "none"
-                                      and new_props["east"] == "none" and new_props["west"] == "none")
-                    is_straight_ew = (new_props["east"] != "none" and new_props["west"] != "none"
-                                      and new_props["north"] == "none" and new_props["south"] == "none")
-                    is_straight = is_straight_ns or is_straight_ew
-
-                    if _is_solid_for_connection(n_above) or not is_straight or sides_connected != 2:
-                        new_props["up"] = "true"
-                    else:
-                        new_props["up"] = "false"
+    # 一次读入区域 (四周各扩 1 格, 上方扩 1 格用于邻居判断)
+    view = RegionView(level, min_x - 1, min_y, min_z - 1, max_x + 1, max_y + 1, max_z + 1, dim, ver)
+    updates = _connection_updates(view)
+    for x, y, z, name, props in updates:
+        place_block(level, x, y, z, dim, ver, name, props)
+
+    print(f"连接修复完成: {len(updates)} 个方块已更新")
+    return len(updates)
+
+def fix_connections(level, dim, ver):
+    """增量修复连接: 只重新计算本次会话中写过、或邻居被改动过的可连接方块
+    place_block 会按子区块记录写入位置, 在建筑完成后调用一次即可"""
+    import numpy as np
+
+    state = _session(_unwrap_level(level))
+    touched = [key for key in state.written if key[0] == dim]
+    # 邻居的改动会影响连接: 子区块向 x/z 两侧和下方扩展一格
+    columns = {}
+    for _, sx, sy, sz in touched:
+        for nx, ny, nz in ((sx, sy, sz), (sx - 1, sy, sz), (sx + 1, sy, sz),
+                           (sx, sy, sz - 1), (sx, sy, sz + 1), (sx, sy - 1, sz)):
+            columns.setdefault((nx, nz), set()).add(ny)
+
+    updates = []
+    for (sx, sz), sys_ in sorted(columns.items()):
+        y_lo, y_hi = min(sys_) * 16, max(sys_) * 16 + 15
+        view = RegionView(level, sx * 16 - 1, y_lo, sz * 16 - 1, sx * 16 + 16, y_hi + 1, sz * 16 + 16, dim, ver)
+        written = np.zeros(view.shape, dtype=bool)
+        for wx in (sx - 1, sx, sx + 1):
+            for wz in (sz - 1, sz, sz + 1):
+                for wy in range(y_lo >> 4, (y_hi + 1 >> 4) + 1):
+                    mask = state.written.get((dim, wx, wy, wz))
+                    if mask is None:
+                        continue
+                    mask = np.frombuffer(mask, dtype=np.uint8).reshape(16, 16, 16).astype(bool)
+                    # 子区块与 view 的重叠部分
+                    ox, oy, oz = wx * 16 - view.min_x, wy * 16 - view.min_y, wz * 16 - view.min_z
+                    a = [max(0, o) for o in (ox, oy, oz)]
+                    b = [min(n, o + 16) for n, o in zip(view.shape, (ox, oy, oz))]
+                    if any(lo >= hi for lo, hi in zip(a, b)):
+                        continue
+                    written[a[0]:b[0], a[1]:b[1], a[2]:b[2]] |= mask[
+                        a[0] - ox:b[0] - ox, a[1] - oy:b[1] - oy, a[2] - oz:b[2] - oz]
+        # 自身被写入, 或水平邻居 / 上方方块被写入
+        region = written.copy()
+        region[:, :, 1:] |= written[:, :, :-1]
+        region[:, :, :-1] |= written[:, :, 1:]
+        region[1:] |= written[:-1]
+        region[:-1] |= written[1:]
+        region[:, :-1] |= written[:, 1:]
+        # 只处理本区块列内的位置, 相邻区块列由各自的 view 处理
+        inner = np.zeros(view.shape, dtype=bool)
+        inner[1:17, :, 1:17] = True
+        updates.extend(_connection_updates(view, region & inner))
+
+    for x, y, z, name, props in updates:
+        place_block(level, x, y, z, dim, ver, name, props)
+    for key in [key for key in state.written if key[0] == dim]:
+        del state.written[key]
+
+    print(f"连接修复完成: {len(updates)} 个方块已更新")
+    return len(updates)
 
-                    tag_props = {}
-                    for k, v in new_props.items():
-                        tag_props[k] = amulet.StringTag(str(v))
-                    new_block = Block("minecraft", bid, tag_props)
-                    level.set_version_block(x, y, z, dim, ver, new_block)
-                    count += 1
+# ============================================
+# 核心: 批量写入
+# ============================================
 
-    print(f"连接修复完成: {count} 个方块已更新")
-    return count
+class BlockWriter:
+    """按 (区块, 子区块) 缓冲方块写入, 每个方块状态只翻译一次,
+    flush 时以 NumPy 批量赋值写入区块方块数组, 绕过逐块的 set_version_block。
+
+    BlockWriter 可以直接当作 level 传给任意原语/预设:
+        with BlockWriter(level) as w:
+            build_box(w, ...)
+            paste_structure(w, ...)
+    读取 (get_version_block) 前会先写出该区块的缓冲, 保证读到最新内容。"""
+
+    def __init__(self, level, max_pending=1_000_000):
+        # max_pending: 缓冲写入数达到该值时自动 flush, None 表示只在显式 flush 时写出
+        self.level = level
+        self.max_pending = max_pending
+        self.pending = 0
+        self.writes = 0
+        self.flushed = 0
+        self._chunks = {}      # (dim, cx, cz) -> {cy: array('q')}, 每项 = sid<<12 | 子区块内索引
+        self._states = []      # sid -> (Block, game_version)
+        self._state_ids = {}   # (id(Block), game_version) -> sid
+        self._universal = {}   # sid -> (universal Block, universal BlockEntity)
+        self._entities = {}    # (dim, cx, cz) -> {(x, y, z): (sid, 版本 BlockEntity)}, flush 时整区块写入
+        self.direct_fill = True  # fill_box 是否直接写区块数组 (parallel_build 编译阶段关闭)
+        _SESSIONS[self] = _session(level)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        return False
+
+    def __getattr__(self, name):
+        # 其他属性 (level_wrapper, get_chunk 等) 透传给底层 level
+        return getattr(self.level, name)
+
+    def set_version_block(self, x, y, z, dimension, game_version, block, block_entity=None):
+        sid = self._state_id(block, game_version)
+        ckey = (dimension, x >> 4, z >> 4)
+        if block_entity is not None:
+            # 方块实体随方块一起缓冲, flush 时按区块批量写入
+            self._entities.setdefault(ckey, {})[(x, y, z)] = (sid, block_entity)
+        sections = self._chunks.get(ckey)
+        if sections is None:
+            sections = self._chunks[ckey] = {}
+        buf = sections.get(y >> 4)
+        if buf is None:
+            buf = sections[y >> 4] = array("q")
+        elif len(buf) >= _SECTION_COMPACT_AT:
+            # 缓冲中反复覆盖同一子区块: 先合并, 只保留每个坐标的最后一次写入
+            buf = sections[y >> 4] = self._compact(buf)
+        buf.append(sid << 12 | (x & 15) << 8 | (y & 15) << 4 | (z & 15))
+        self.pending += 1
+        self.writes += 1
+        if self.max_pending and self.pending >= self.max_pending:
+            self.flush()
+
+    def set_many(self, xs, ys, zs, dimension, game_version, block):
+        """批量写入同一方块状态: xs/ys/zs 为等长整数数组, 按子区块分组后整段追加到缓冲"""
+        import numpy as np
+
+        xs, ys, zs = (np.asarray(a, dtype=np.int64).reshape(-1) for a in (xs, ys, zs))
+        if not len(xs):
+            return
+        sid = self._state_id(block, game_version)
+        packed = (sid << 12) | (xs & 15) << 8 | (ys & 15) << 4 | (zs & 15)
+        for (cx, cy, cz), part in _group_by_section(xs, ys, zs, packed):
+            sections = self._chunks.get((dimension, cx, cz))
+            if sections is None:
+                sections = self._chunks[(dimension, cx, cz)] = {}
+            buf = sections.get(cy)
+            if buf is None:
+                buf = sections[cy] = array("q")
+            buf.frombytes(part.tobytes())
+        self.pending += len(xs)
+        self.writes += len(xs)
+        _session(self.level).record_many(dimension, xs, ys, zs)
+        if self.max_pending and self.pending >= self.max_pending:
+            self.flush()
+
+    def fill_box(self, x1, y1, z1, x2, y2, z2, dimension, game_version, block):
+        """整块填充长方体: 按 (区块, 子区块) 直接切片赋值到区块数组, 开销与涉及的子区块数成正比
+        缓冲中落在盒内的旧写入被丢弃 (后写覆盖先写), 盒外缓冲不受影响"""
+        import numpy as np
+        from amulet.api.errors import ChunkDoesNotExist
+
+        min_x, max_x = min(x1, x2), max(x1, x2)
+        min_y, max_y = min(y1, y2), max(y1, y2)
+        min_z, max_z = min(z1, z2), max(z1, z2)
+        sid = self._state_id(block, game_version)
+        ublock, ube = self._translate(sid)
+        if ube is not None or not self.direct_fill:
+            # 带方块实体的方块 / 只记录不落盘的场合 (parallel_build 编译阶段): 走普通缓冲
+            xs, ys, zs = (a.reshape(-1) for a in np.mgrid[min_x:max_x + 1, min_y:max_y + 1, min_z:max_z + 1])
+            self.set_many(xs, ys, zs, dimension, game_version, block)
+            return
+        volume = (max_x - min_x + 1) * (max_y - min_y + 1) * (max_z - min_z + 1)
+        state = _session(self.level)
+        for cx in range(min_x >> 4, (max_x >> 4) + 1):
+            ax, bx = max(min_x, cx * 16) - cx * 16, min(max_x, cx * 16 + 15) - cx * 16 + 1
+            for cz in range(min_z >> 4, (max_z >> 4) + 1):
+                az, bz = max(min_z, cz * 16) - cz * 16, min(max_z, cz * 16 + 15) - cz * 16 + 1
+                key = (dimension, cx, cz)
+                self._drop_buffered(key, min_x, min_y, min_z, max_x, max_y, max_z)
+                state.mark_dirty(dimension, cx, cz)
+                try:
+                    chunk = self.level.get_chunk(cx, cz, dimension)
+                except ChunkDoesNotExist:
+                    chunk = self.level.create_chunk(cx, cz, dimension)
+                rid = chunk.block_palette.get_add_block(ublock)
+                for cy in range(min_y >> 4, (max_y >> 4) + 1):
+                    ay, by = max(min_y, cy * 16) - cy * 16, min(max_y, cy * 16 + 15) - cy * 16 + 1
+                    chunk.blocks.get_sub_chunk(cy)[ax:bx, ay:by, az:bz] = rid
+                for loc in list(chunk.block_entities):
+                    x, y, z = loc
+                    if min_x <= x <= max_x and min_y <= y <= max_y and min_z <= z <= max_z:
+                        del chunk.block_entities[loc]
+                chunk.changed = True
+        state.record_box(dimension, min_x, min_y, min_z, max_x, max_y, max_z)
+        self.writes += volume
+        self.flushed += volume
+
+    def _drop_buffered(self, key, min_x, min_y, min_z, max_x, max_y, max_z):
+        """丢弃某区块缓冲中落在长方体内的写入与方块实体"""
+        import numpy as np
+
+        sections = self._chunks.get(key)
+        if sections:
+            _, cx, cz = key
+            for cy, buf in list(sections.items()):
+                packed = np.frombuffer(buf, dtype=np.int64)
+                x = cx * 16 + (packed >> 8 & 15)
+                y = cy * 16 + (packed >> 4 & 15)
+                z = cz * 16 + (packed & 15)
+                inside = ((x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)
+                          & (z >= min_z) & (z <= max_z))
+                if inside.any():
+                    self.pending -= int(inside.sum())
+                    sections[cy] = array("q", packed[~inside].tobytes())
+        entities = self._entities.get(key)
+        if entities:
+            for x, y, z in list(entities):
+                if min_x <= x <= max_x and min_y <= y <= max_y and min_z <= z <= max_z:
+                    del entities[(x, y, z)]
+
+    def _compact(self, buf):
+        import numpy as np
+
+        packed = np.frombuffer(buf, dtype=np.int64)
+        kept = _last_writes(packed)
+        self.pending -= len(packed) - len(kept)
+        return array("q", kept.tobytes())
+
+    @property
+    def saved(self):
+        """被后续写入覆盖、没有落盘的写入数"""
+        return self.writes - self.pending - self.flushed
+
+    def stats(self):
+        return {"writes": self.writes, "flushed": self.flushed,
+                "saved": self.saved, "pending": self.pending}
+
+    def _state_id(self, block, game_version):
+        skey = (id(block), game_version)
+        sid = self._state_ids.get(skey)
+        if sid is None:
+            sid = self._state_ids[skey] = len(self._states)
+            self._states.append((block, game_version))
+        return sid
+
+    def get_version_block(self, x, y, z, dimension, game_version):
+        self._flush_chunk((dimension, x >> 4, z >> 4))
+        return self.level.get_version_block(x, y, z, dimension, game_version)
+
+    def flush(self):
+        """把所有缓冲写入区块 (按区块坐标顺序)"""
+        for key in sorted(self._chunks):
+            self._flush_chunk(key)
+
+    def save(self):
+        self.flush()
+        self.level.save()
+
+    def close(self):
+        self.flush()
+        self.level.close()
+
+    def _translate(self, sid):
+        """方块状态 -> (universal Block, universal BlockEntity), 每个状态只翻译一次"""
+        cached = self._universal.get(sid)
+        if cached is None:
+            block, game_version = self._states[sid]
+            version = self.level.translation_manager.get_version(*game_version)
+            ublock, ube, _ = version.block.to_universal(block)
+            cached = self._universal[sid] = (ublock, ube)
+        return cached
+
+    def _flush_chunk(self, key):
+        sections = self._chunks.pop(key, None)
+        entities = self._entities.pop(key, None)
+        if not sections:
+            return
+        self.pending -= sum(len(buf) for buf in sections.values())
+        self._apply_encoded(key, _encode_sections({cy: buf.tobytes() for cy, buf in sections.items()}),
+                            entities)
+
+    def _apply_encoded(self, key, encoded, entities=None):
+        """把 _encode_sections 的结果写入区块: 每个子区块的状态映射一次到区块调色板, 再整段赋值
+        entities: {(x, y, z): (sid, 版本 BlockEntity)}, 位置的最终状态仍为 sid 时一并写入"""
+        import numpy as np
+        from amulet.api.errors import ChunkDoesNotExist
+
+        dimension, cx, cz = key
+        _session(self.level).mark_dirty(*key)
+        try:
+            chunk = self.level.get_chunk(cx, cz, dimension)
+        except ChunkDoesNotExist:
+            chunk = self.level.create_chunk(cx, cz, dimension)
+
+        written = {}        # cy -> 本次写入位置的掩码
+        final_sid = {}      # cy -> (sids, local), 用于判断位置的最终状态
+        entity_writes = []  # 带方块实体的状态, 逐块写入
+        for cy, (sids, local) in encoded.items():
+            sids = np.frombuffer(sids, dtype=np.int32)
+            local = np.frombuffer(local, dtype=np.int16).reshape(16, 16, 16)
+            final_sid[cy] = (sids, local)
+            lut = np.empty(len(sids), dtype=np.uint32)
+            for i, sid in enumerate(sids.tolist()):
+                ublock, ube = self._translate(sid)
+                lut[i] = chunk.block_palette.get_add_block(ublock)
+                if ube is not None:
+                    for lx, ly, lz in np.argwhere(local == i).tolist():
+                        pos = (cx * 16 + lx, cy * 16 + ly, cz * 16 + lz)
+                        if not entities or pos not in entities:
+                            entity_writes.append((*pos, sid))
+            touched = local >= 0
+            sub = chunk.blocks.get_sub_chunk(cy)
+            sub[touched] = lut[local[touched]]
+            written[cy] = touched
+            self.flushed += int(np.count_nonzero(touched))
+
+        # 被覆盖位置上的旧方块实体需要删除
+        for loc in list(chunk.block_entities):
+            x, y, z = loc
+            mask = written.get(y >> 4)
+            if mask is not None and mask[x & 15, y & 15, z & 15]:
+                del chunk.block_entities[loc]
+
+        # 显式给出的方块实体: 翻译为通用格式后直接放入区块
+        for (x, y, z), (sid, block_entity) in (entities or {}).items():
+            sids, local = final_sid.get(y >> 4, (None, None))
+            i = -1 if local is None else local[x & 15, y & 15, z & 15]
+            if i < 0 or sids[i] != sid:
+                continue  # 之后又被其他方块覆盖
+            block, game_version = self._states[sid]
+            version = self.level.translation_manager.get_version(*game_version)
+            _, ube, _ = version.block.to_universal(block, block_entity, block_location=(x, y, z))
+            if ube is not None:
+                chunk.block_entities[(x, y, z)] = ube.new_at_location(x, y, z)
+        chunk.changed = True
+
+        for x, y, z, sid in entity_writes:
+            block, game_version = self._states[sid]
+            self.level.set_version_block(x, y, z, dimension, game_version, block)
+
+def _batched(build_fn):
+    """预设建筑装饰器: 传入原始 level 时自动套一层 BlockWriter (后写覆盖先写),
+    同一坐标的多次写入只落盘最后一次, 结束时报告节省的写入数。
+    已经是 BlockWriter / BuildPlan 时原样传入。"""
+    @functools.wraps(build_fn)
+    def wrapper(level, *args, **kwargs):
+        if isinstance(level, (BlockWriter, BuildPlan)):
+            return build_fn(level, *args, **kwargs)
+        with BlockWriter(level) as writer:
+            result = build_fn(writer, *args, **kwargs)
+        if writer.writes:
+            print(f"  写入合并: 请求 {writer.writes} 次, 实际写入 {writer.flushed} 次, "
+                  f"节省 {writer.saved} 次 ({writer.saved * 100 // writer.writes}%)")
+        return result
+    return wrapper
+
+def _group_by_section(xs, ys, zs, values):
+    """按子区块 (cx, cy, cz) 分组, 组内保持原有顺序; 产出 ((cx, cy, cz), values 子数组)"""
+    import numpy as np
+
+    cx, cy, cz = xs >> 4, ys >> 4, zs >> 4
+    key = ((cx + (1 << 21)) << 32) | ((cz + (1 << 21)) << 10) | (cy + (1 << 9))
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    ends = np.r_[starts[1:], len(key)]
+    for a, b in zip(starts.tolist(), ends.tolist()):
+        i = order[a]
+        yield (int(cx[i]), int(cy[i]), int(cz[i])), values[order[a:b]]
+
+# 单个子区块缓冲达到该长度时先合并重复坐标, 限制缓冲内存
+_SECTION_COMPACT_AT = 16384
+
+def _last_writes(packed):
+    """打包写入数组 (sid<<12 | 子区块内索引) 中每个坐标只保留最后一次, 保持原有先后顺序"""
+    import numpy as np
+
+    _, last = np.unique(packed[::-1] & 0xFFF, return_index=True)
+    return packed[np.sort(len(packed) - 1 - last)]
+
+def _encode_sections(sections):
+    """把一个区块的写入列表编码为子区块局部调色板 + 稠密下标数组 (纯 NumPy, 可在子进程中执行)
+    sections: {cy: int64 打包写入 (sid<<12 | 子区块内索引) 的 bytes}
+    返回 {cy: (sids, local)}: sids 为 int32 升序状态表的 bytes, local 为 int16[16*16*16] 的 bytes,
+    值为 sids 下标, -1 表示未写入; 同一坐标以最后一次写入为准"""
+    import numpy as np
+
+    encoded = {}
+    for cy, buf in sections.items():
+        packed = _last_writes(np.frombuffer(buf, dtype=np.int64))
+        sids, inverse = np.unique(packed >> 12, return_inverse=True)
+        local = np.full(4096, -1, dtype=np.int16)
+        local[packed & 0xFFF] = inverse.reshape(-1)
+        encoded[cy] = (sids.astype(np.int32).tobytes(), local.tobytes())
+    return encoded
+
+def _encode_chunk_batch(batch):
+    """子进程入口: [(key, sections)] -> [(key, encoded)], 一批为相邻的若干区块"""
+    return [(key, _encode_sections(sections)) for key, sections in batch]
+
+def parallel_build(level, build_fn, *args, workers=None, save=True, **kwargs):
+    """多进程执行建筑 (可选模式): 先把 build_fn 编译成按区块分组的写入列表 (不触碰世界),
+    再把相邻区块成批分给 ProcessPoolExecutor: 子进程做去重、子区块调色板映射和下标数组编码,
+    主进程只把编码结果映射到区块调色板、整段赋值并保存。
+    build_fn 为任意原语/预设 (如 build_skyscraper), 其余参数原样传入:
+        parallel_build(level, build_skyscraper, bx, by, bz, dim, ver, floors=60)
+    workers: 进程数, 默认 CPU 核数; <=1 或区块不足两个时在本进程编码
+    build_fn 的执行、amulet 的调色板翻译与 level.save() 的 NBT 编码仍在主进程, 加速取决于编码所占比例
+    注意: macOS/Windows 以 spawn 启动子进程, 调用脚本需放在 if __name__ == "__main__": 下"""
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+
+    t0 = time.time()
+    writer = BlockWriter(level, max_pending=None)
+    writer.direct_fill = False
+    result = build_fn(writer, *args, **kwargs)
+    jobs = sorted((key, {cy: buf.tobytes() for cy, buf in sections.items()})
+                  for key, sections in writer._chunks.items())
+    writer._chunks.clear()
+    writer.pending = 0
+    t1 = time.time()
+
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(jobs) < 2:
+        mode = "本进程编码"
+        encoded = _encode_chunk_batch(jobs)
+    else:
+        # 按区块坐标排序后切成连续批次, 每个进程若干批以平衡负载
+        mode = f"{workers} 进程编码"
+        size = max(1, -(-len(jobs) // (workers * 4)))
+        batches = [jobs[i:i + size] for i in range(0, len(jobs), size)]
+        encoded = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for part in pool.map(_encode_chunk_batch, batches):
+                encoded.extend(part)
+    t2 = time.time()
+
+    for key, sections in encoded:
+        writer._apply_encoded(key, sections, writer._entities.pop(key, None))
+    if save:
+        level.save()
+    t3 = time.time()
+    print(f"并行建造完成: {len(jobs)} 个区块, {writer.flushed} 个方块, {mode} "
+          f"(编译 {t1 - t0:.1f}s, 编码 {t2 - t1:.1f}s, 合并{'保存' if save else ''} {t3 - t2:.1f}s)")
+    return result
+
+# ============================================
+# 核心: 建筑计划 (记录 -> 优化 -> 应用)
+# ============================================
+
+class BuildPlan:
+    """建筑计划 IR: 把建造过程记录为紧凑的操作列表, 不写入世界
+
+    操作 (元组, sid 为计划内方块状态编号):
+        ("set", x, y, z, sid)
+        ("fill", x1, y1, z1, x2, y2, z2, sid)
+        ("shell", x1, y1, z1, x2, y2, z2, sid, air_sid)    空心盒子, 内部为空气
+        ("cylinder", cx, cz, y1, y2, radius, sid, air_sid)  air_sid=-1 表示实心
+        ("paste", template_index, x, y, z, rotate, mirror)
+    BuildPlan 可以当作 level 传给原语/预设 (计划模式), 之后 optimize() 再 apply()。
+    计划模式下的读取直接读底层世界 (看不到计划中尚未应用的写入)。"""
+
+    def __init__(self, level=None):
+        self.level = level
+        self.ops = []
+        self.templates = []
+        self.dimension = None
+        self.states = []      # sid -> (Block, game_version)
+        self._state_ids = {}  # (id(Block), game_version) -> sid
+        self.result = None
+
+    def __getattr__(self, name):
+        if self.level is None:
+            raise AttributeError(name)
+        return getattr(self.level, name)
+
+    def __len__(self):
+        return len(self.ops)
+
+    # ---------- 记录 ----------
+
+    def _sid(self, dimension, game_version, block):
+        if self.dimension is None:
+            self.dimension = dimension
+        elif dimension != self.dimension:
+            raise ValueError(f"BuildPlan 只支持单一维度: {self.dimension} / {dimension}")
+        key = (id(block), game_version)
+        sid = self._state_ids.get(key)
+        if sid is None:
+            sid = self._state_ids[key] = len(self.states)
+            self.states.append((block, game_version))
+        return sid
+
+    def _block_sid(self, dimension, game_version, block_name, props=None):
+        return self._sid(dimension, game_version, _BLOCK_CACHE.get(block_name, props, game_version))
+
+    def set_version_block(self, x, y, z, dimension, game_version, block, block_entity=None):
+        if block_entity is not None:
+            raise ValueError("BuildPlan 不记录带方块实体的写入")
+        self.ops.append(("set", x, y, z, self._sid(dimension, game_version, block)))
+
+    def get_version_block(self, x, y, z, dimension, game_version):
+        if self.level is None:
+            raise ValueError("BuildPlan 未绑定 level, 无法读取方块")
+        return self.level.get_version_block(x, y, z, dimension, game_version)
+
+    def fill(self, x1, y1, z1, x2, y2, z2, dimension, game_version, block_name, props=None):
+        self.ops.append(("fill", min(x1, x2), min(y1, y2), min(z1, z2), max(x1, x2), max(y1, y2),
+                         max(z1, z2), self._block_sid(dimension, game_version, block_name, props)))
+
+    def shell(self, x1, y1, z1, x2, y2, z2, dimension, game_version, block_name, props=None):
+        self.ops.append(("shell", min(x1, x2), min(y1, y2), min(z1, z2), max(x1, x2), max(y1, y2),
+                         max(z1, z2), self._block_sid(dimension, game_version, block_name, props),
+                         self._block_sid(dimension, game_version, "air")))
+
+    def cylinder(self, cx, cz, y1, y2, radius, dimension, game_version, block_name, props=None, hollow=True):
+        air = self._block_sid(dimension, game_version, "air") if hollow else -1
+        self.ops.append(("cylinder", cx, cz, min(y1, y2), max(y1, y2), radius,
+                         self._block_sid(dimension, game_version, block_name, props), air))
+
+    def paste(self, template, x, y, z, dimension, game_version, rotate=0, mirror=False):
+        self._sid(dimension, game_version, _BLOCK_CACHE.get("air", None, game_version))
+        self.templates.append((template, game_version))
+        self.ops.append(("paste", len(self.templates) - 1, x, y, z, rotate, mirror))
+
+    # ---------- 分析 ----------
+
+    def op_bbox(self, op):
+        """操作的包围盒 (x1, y1, z1, x2, y2, z2)"""
+        kind = op[0]
+        if kind == "set":
+            return op[1], op[2], op[3], op[1], op[2], op[3]
+        if kind in ("fill", "shell"):
+            return op[1:7]
+        if kind == "cylinder":
+            _, cx, cz, y1, y2, r = op[:6]
+            return cx - r, y1, cz - r, cx + r, y2, cz + r
+        template = self.templates[op[1]][0]
+        sx, sy, sz = template["size"]
+        if op[5] in (90, 270):
+            sx, sz = sz, sx
+        return op[2], op[3], op[4], op[2] + sx - 1, op[3] + sy - 1, op[4] + sz - 1
+
+    def op_volume(self, op):
+        """操作写入的材料方块数 (空心盒子/圆柱只计外壳, 内部空气见 op_air)"""
+        kind = op[0]
+        if kind == "set":
+            return 1
+        if kind == "fill":
+            return _box_volume(op[1:7])
+        if kind == "shell":
+            return sum(_box_volume(face) for face in _shell_faces(*op[1:7]))
+        if kind == "cylinder":
+            wall = _hollow_disc_masks(op[5])[0] if op[7] >= 0 else disc_mask(op[5])
+            return int(wall.sum()) * (op[4] - op[3] + 1)
+        return self.templates[op[1]][0]["block_count"]
+
+    def op_air(self, op):
+        """空心盒子/圆柱内部写入的空气方块数"""
+        kind = op[0]
+        if kind == "shell":
+            x1, y1, z1, x2, y2, z2 = op[1:7]
+            if x2 - x1 > 1 and y2 - y1 > 1 and z2 - z1 > 1:
+                return (x2 - x1 - 1) * (y2 - y1 - 1) * (z2 - z1 - 1)
+        elif kind == "cylinder" and op[7] >= 0:
+            return int(_hollow_disc_masks(op[5])[1].sum()) * (op[4] - op[3] + 1)
+        return 0
+
+    def stats(self):
+        """成本估算: 操作数、写入方块数、涉及区块数、材料清单"""
+        kinds = {}
+        materials = {}
+        chunks = set()
+        writes = 0
+        for op in self.ops:
+            kinds[op[0]] = kinds.get(op[0], 0) + 1
+            n = self.op_volume(op)
+            air = self.op_air(op)
+            writes += n + air
+            if op[0] != "paste":
+                name = self.states[op[-2] if op[0] in ("shell", "cylinder") else op[-1]][0].base_name
+                materials[name] = materials.get(name, 0) + n
+            if air:
+                materials["air"] = materials.get("air", 0) + air
+            x1, _, z1, x2, _, z2 = self.op_bbox(op)
+            for cx in range(x1 >> 4, (x2 >> 4) + 1):
+                for cz in range(z1 >> 4, (z2 >> 4) + 1):
+                    chunks.add((cx, cz))
+        return {"ops": len(self.ops), "kinds": kinds, "writes": writes,
+                "chunks": len(chunks), "materials": materials}
+
+    # ---------- 优化 ----------
+
+    def optimize(self):
+        """死写消除 + 合并相邻/重叠的同材料填充, 返回删减的操作数"""
+        before = len(self.ops)
+        self._eliminate_dead_writes()
+        while self._merge_fills():
+            pass
+        removed = before - len(self.ops)
+        print(f"计划优化: {before} -> {len(self.ops)} 个操作")
+        return removed
+
+    def _eliminate_dead_writes(self):
+        """倒序扫描: 完全落在后续 fill/shell 内的操作、被后续 set 覆盖的 set 都是死写"""
+        covers = []     # 后续完整覆盖包围盒的操作
+        later_sets = set()
+        kept = []
+        for op in reversed(self.ops):
+            x1, y1, z1, x2, y2, z2 = self.op_bbox(op)
+            if op[0] == "set" and (op[1], op[2], op[3]) in later_sets:
+                continue
+            if any(a[0] <= x1 and a[1] <= y1 and a[2] <= z1 and x2 <= a[3] and y2 <= a[4] and z2 <= a[5]
+                   for a in covers):
+                continue
+            kept.append(op)
+            if op[0] == "set":
+                later_sets.add((op[1], op[2], op[3]))
+            elif op[0] in ("fill", "shell"):
+                covers.append((x1, y1, z1, x2, y2, z2))
+        kept.reverse()
+        self.ops = kept
+
+    def _merge_fills(self, window=16):
+        """把 set/fill 并入之前同材料、并集仍为长方体的 fill (中间的操作不得与之相交)"""
+        merged = []
+        changed = False
+        for op in self.ops:
+            if op[0] in ("set", "fill"):
+                box = self.op_bbox(op)
+                target = None
+                for i in range(len(merged) - 1, max(-1, len(merged) - 1 - window), -1):
+                    prev = merged[i]
+                    if prev[0] in ("set", "fill") and prev[-1] == op[-1]:
+                        union = _box_union(self.op_bbox(prev), box)
+                        if union is not None:
+                            target = (i, union)
+                            break
+                    if _boxes_intersect(self.op_bbox(prev), box):
+                        break
+                if target is not None:
+                    i, union = target
+                    merged[i] = ("fill",) + tuple(union) + (op[-1],)
+                    changed = True
+                    continue
+            merged.append(op)
+        self.ops = merged
+        return changed
+
+    # ---------- 应用 ----------
+
+    def apply(self, level=None):
+        """把计划写入世界 (按区块顺序批量写出), 返回写入方块数"""
+        import numpy as np
+
+        level = level if level is not None else self.level
+        writer = level if isinstance(level, BlockWriter) else BlockWriter(level, max_pending=None)
+        writes_before = writer.writes
+        session = _session(writer.level)
+        dim = self.dimension
+        for op in self.ops:
+            kind = op[0]
+            if kind == "paste":
+                template, game_version = self.templates[op[1]]
+                paste_structure(writer, template, op[2], op[3], op[4], dim, game_version, op[5], op[6])
+                continue
+            if kind == "set":
+                block, game_version = self.states[op[4]]
+                writer.set_version_block(op[1], op[2], op[3], dim, game_version, block)
+                session.record(dim, op[1], op[2], op[3])
+                continue
+            if kind in ("fill", "shell"):
+                x1, y1, z1, x2, y2, z2 = op[1:7]
+                block, game_version = self.states[op[7]]
+                if kind == "fill":
+                    writer.fill_box(x1, y1, z1, x2, y2, z2, dim, game_version, block)
+                    continue
+                if x2 - x1 > 1 and y2 - y1 > 1 and z2 - z1 > 1:
+                    air, air_version = self.states[op[8]]
+                    writer.fill_box(x1 + 1, y1 + 1, z1 + 1, x2 - 1, y2 - 1, z2 - 1, dim, air_version, air)
+                for face in _shell_faces(x1, y1, z1, x2, y2, z2):
+                    writer.fill_box(*face, dim, game_version, block)
+                continue
+            # cylinder
+            _, cx, cz, y1, y2, r, sid, air = op
+            wall, hole = _hollow_disc_masks(r) if air >= 0 else (disc_mask(r), None)
+            for part, target in ((hole, air), (wall, sid)):
+                if part is None or not part.any():
+                    continue
+                px, pz = np.nonzero(part)
+                px, pz = px + cx - r, pz + cz - r
+                n = y2 - y1 + 1
+                block, game_version = self.states[target]
+                writer.set_many(np.tile(px, n), np.repeat(np.arange(y1, y2 + 1), len(px)),
+                                np.tile(pz, n), dim, game_version, block)
+        count = writer.writes - writes_before
+        if writer is not level:
+            writer.flush()
+        print(f"计划已应用: {len(self.ops)} 个操作, 写入 {count} 个方块")
+        return count
+
+def _box_volume(box):
+    x1, y1, z1, x2, y2, z2 = box
+    return (x2 - x1 + 1) * (y2 - y1 + 1) * (z2 - z1 + 1)
+
+def _box_union(a, b):
+    """两个长方体的并集若仍为长方体则返回之, 否则 None"""
+    same = [a[i] == b[i] and a[i + 3] == b[i + 3] for i in range(3)]
+    if all(same):
+        return a
+    # 一个包含另一个
+    if all(a[i] <= b[i] and b[i + 3] <= a[i + 3] for i in range(3)):
+        return a
+    if all(b[i] <= a[i] and a[i + 3] <= b[i + 3] for i in range(3)):
+        return b
+    # 两个轴相同, 第三个轴相接或重叠
+    if sum(same) == 2:
+        i = same.index(False)
+        if a[i] <= b[i + 3] + 1 and b[i] <= a[i + 3] + 1:
+            lo = [min(a[j], b[j]) for j in range(3)]
+            hi = [max(a[j + 3], b[j + 3]) for j in range(3)]
+            return tuple(lo + hi)
+    return None
+
+def _boxes_intersect(a, b):
+    return all(a[i] <= b[i + 3] and b[i] <= a[i + 3] for i in range(3))
+
+def plan_build(level, build_fn, *args, **kwargs):
+    """计划模式运行建筑函数: 只生成 BuildPlan, 不写入世界
+        plan = plan_build(level, build_simple_house, bx, by, bz, dim, ver)
+        plan.optimize(); print(plan.stats()); plan.apply()"""
+    plan = BuildPlan(level)
+    plan.result = build_fn(plan, *args, **kwargs)
+    print(f"计划生成: {len(plan.ops)} 个操作")
+    return plan
+
+# ============================================
+# 核心: 区域读取
+# ============================================
+
+def _unwrap_level(level):
+    """BlockWriter 等包装对象: 先写出缓冲, 返回底层 level 以便直接读取区块"""
+    if isinstance(level, BlockWriter):
+        level.flush()
+        return level.level
+    if isinstance(level, BuildPlan):
+        return level.level
+    return level
+
+class RegionView:
+    """一次性把包围盒内的方块读入 NumPy 数组, 之后整块做数组查询
+
+    indices: 形状 (dx, dy, dz) 的调色板索引数组, 下标为相对 origin 的坐标
+    palette: 调色板 base_name 列表 (索引 0 固定为 air, 未生成的区块/子区块按 air 处理)
+    blocks:  调色板对应的版本方块 (Block)"""
+
+    def __init__(self, level, x1, y1, z1, x2, y2, z2, dimension, game_version):
+        import numpy as np
+        from amulet.api.errors import ChunkDoesNotExist, ChunkLoadError
+
+        level = _unwrap_level(level)
+        self.min_x, self.max_x = min(x1, x2), max(x1, x2)
+        self.min_y, self.max_y = min(y1, y2), max(y1, y2)
+        self.min_z, self.max_z = min(z1, z2), max(z1, z2)
+        self.origin = (self.min_x, self.min_y, self.min_z)
+        self.shape = (self.max_x - self.min_x + 1, self.max_y - self.min_y + 1,
+                      self.max_z - self.min_z + 1)
+        self.indices = np.zeros(self.shape, dtype=np.uint32)
+        air = _BLOCK_CACHE.get("air", None, game_version)
+        self.blocks = [air]
+        self.palette = ["air"]
+        self._ids = {air: 0}
+        self._version = level.translation_manager.get_version(*game_version)
+
+        for cx in range(self.min_x >> 4, (self.max_x >> 4) + 1):
+            ax, bx = max(self.min_x, cx * 16), min(self.max_x, cx * 16 + 15)
+            for cz in range(self.min_z >> 4, (self.max_z >> 4) + 1):
+                az, bz = max(self.min_z, cz * 16), min(self.max_z, cz * 16 + 15)
+                try:
+                    chunk = level.get_chunk(cx, cz, dimension)
+                except (ChunkDoesNotExist, ChunkLoadError):
+                    continue
+                present = set(chunk.blocks.sub_chunks)
+                local_ids = {}  # 本区块 universal id -> 区域调色板索引
+                for cy in range(self.min_y >> 4, (self.max_y >> 4) + 1):
+                    if cy not in present:
+                        continue
+                    ay, by = max(self.min_y, cy * 16), min(self.max_y, cy * 16 + 15)
+                    sub = chunk.blocks.get_sub_chunk(cy)[
+                        ax - cx * 16:bx - cx * 16 + 1,
+                        ay - cy * 16:by - cy * 16 + 1,
+                        az - cz * 16:bz - cz * 16 + 1]
+                    uids, inverse = np.unique(sub, return_inverse=True)
+                    lut = np.empty(len(uids), dtype=np.uint32)
+                    for i, uid in enumerate(uids.tolist()):
+                        idx = local_ids.get(uid)
+                        if idx is None:
+                            idx = local_ids[uid] = self._palette_index(chunk.block_palette[uid])
+                        lut[i] = idx
+                    self.indices[ax - self.min_x:bx - self.min_x + 1,
+                                 ay - self.min_y:by - self.min_y + 1,
+                                 az - self.min_z:bz - self.min_z + 1] = lut[inverse].reshape(sub.shape)
+
+    def _palette_index(self, universal_block):
+        block = self._version.block.from_universal(universal_block)[0]
+        if not hasattr(block, "base_name"):  # 实体等非方块结果按 air 处理
+            return 0
+        idx = self._ids.get(block)
+        if idx is None:
+            idx = self._ids[block] = len(self.blocks)
+            self.blocks.append(block)
+            self.palette.append(block.base_name)
+        return idx
+
+    def contains(self, x, y, z):
+        return (self.min_x <= x <= self.max_x and self.min_y <= y <= self.max_y
+                and self.min_z <= z <= self.max_z)
+
+    def index_at(self, x, y, z):
+        if not self.contains(x, y, z):
+            raise IndexError(f"坐标 ({x},{y},{z}) 不在区域内")
+        return int(self.indices[x - self.min_x, y - self.min_y, z - self.min_z])
+
+    def name_at(self, x, y, z):
+        """返回 base_name, 与 get_block 相同"""
+        return self.palette[self.index_at(x, y, z)]
+
+    def block_at(self, x, y, z):
+        return self.blocks[self.index_at(x, y, z)]
+
+    def lookup(self, names):
+        """调色板布尔查找表: lookup(names)[indices] 即区域掩码
+        names 可以是方块名集合, 也可以是 base_name -> bool 的判定函数"""
+        import numpy as np
+        test = names if callable(names) else names.__contains__
+        return np.fromiter((bool(test(n)) for n in self.palette), dtype=bool, count=len(self.palette))
+
+    def mask(self, names):
+        """区域布尔数组: 方块名属于 names 的位置为 True"""
+        return self.lookup(names)[self.indices]
+
+def _column_top(view, lut):
+    """每一列 (x,z) 从上往下第一个 lut 为 True 的方块
+    返回 (found, ys, top_idx): 是否找到 / 绝对 y / 该方块调色板索引"""
+    import numpy as np
+    hit = lut[view.indices][:, ::-1, :]
+    first = hit.argmax(axis=1)
+    found = hit.any(axis=1)
+    ys = view.max_y - first
+    top_idx = np.take_along_axis(view.indices, (view.shape[1] - 1 - first)[:, None, :], axis=1)[:, 0, :]
+    return found, ys, top_idx
 
 # ============================================
 # 地形工具
 # ============================================
 
+class HeightMap(Mapping):
+    """稠密高度图: heights 为 int16 二维数组, heights[x - origin[0], z - origin[1]] = y
+    NO_HEIGHT 表示该列无结果。同时实现只读 dict 接口 {(x,z): y}, 兼容原有调用方"""
+
+    NO_HEIGHT = -32768
+
+    def __init__(self, heights, origin):
+        self.heights = heights
+        self.origin = origin
+
+    def _offset(self, key):
+        i, k = key[0] - self.origin[0], key[1] - self.origin[1]
+        if 0 <= i < self.heights.shape[0] and 0 <= k < self.heights.shape[1]:
+            return i, k
+        return None
+
+    def __getitem__(self, key):
+        off = self._offset(key)
+        if off is None or self.heights[off] == self.NO_HEIGHT:
+            raise KeyError(key)
+        return int(self.heights[off])
+
+    def __contains__(self, key):
+        off = self._offset(key)
+        return off is not None and self.heights[off] != self.NO_HEIGHT
+
+    def __iter__(self):
+        ox, oz = self.origin
+        for i, k in zip(*self.valid.nonzero()):
+            yield (ox + int(i), oz + int(k))
+
+    def __len__(self):
+        return int(self.valid.sum())
+
+    @property
+    def valid(self):
+        return self.heights != self.NO_HEIGHT
+
+    def to_dict(self):
+        return dict(self.items())
+
+# scan_ground 向下穿过的方块 (非地面); NATURAL_GROUND 与未知方块都视为地面
+_GROUND_SKIP = frozenset({"air", "water", "short_grass", "tall_grass", "fern", "large_fern",
+                          "dead_bush", "sweet_berry_bush", "seagrass",
+                          "sugar_cane", "bamboo", "vine", "kelp",
+                          "brown_mushroom", "red_mushroom"}) | BUILDING_BLOCKS | frozenset(FLOWERS)
+
+# 高度图模式 -> 向下穿过的方块
+_HEIGHTMAP_SKIP = {
+    "terrain": frozenset({"air"}),            # 最高非空气方块 (含建筑), 水面记为无结果
+    "solid": frozenset({"air", "water"}),     # 最高非空气非水方块
+    "ground": _GROUND_SKIP,                   # 自然地面, 跳过建筑/植被
+}
+
+def compute_heightmap(level, x1, z1, x2, z2, dim, ver, y_min=31, y_max=100, mode="terrain"):
+    """逐区块列计算高度图, 对 "是否地面" 掩码做向量化 argmax
+    mode: "terrain" (同 scan_terrain) / "solid" (跳过水) / "ground" (同 scan_ground, 跳过建筑/植被)
+    优先解码区块 NBT 中存储的 Heightmaps; 缺少高度图或本次会话改动过的区块才逐块扫描
+    返回 HeightMap"""
+    import numpy as np
+
+    min_x, max_x = min(x1, x2), max(x1, x2)
+    min_z, max_z = min(z1, z2), max(z1, z2)
+    skip = _HEIGHTMAP_SKIP[mode]
+    heights = np.full((max_x - min_x + 1, max_z - min_z + 1), HeightMap.NO_HEIGHT, dtype=np.int16)
+    dirty = _session(_unwrap_level(level)).dirty_chunks
+    try:
+        reader = _RegionReader(_unwrap_level(level).level_wrapper.path, dim)
+    except AttributeError:
+        reader = None
+
+    for cx in range(min_x >> 4, (max_x >> 4) + 1):
+        ax, bx = max(min_x, cx * 16), min(max_x, cx * 16 + 15)
+        for cz in range(min_z >> 4, (max_z >> 4) + 1):
+            az, bz = max(min_z, cz * 16), min(max_z, cz * 16 + 15)
+            out = heights[ax - min_x:bx - min_x + 1, az - min_z:bz - min_z + 1]
+            cols = (slice(ax - cx * 16, bx - cx * 16 + 1), slice(az - cz * 16, bz - cz * 16 + 1))
+
+            unresolved = np.ones(out.shape, dtype=bool)
+            y_hi = y_max
+            stored = None if (dim, cx, cz) in dirty else _stored_heightmaps(reader, cx, cz)
+            if stored is not None:
+                # WORLD_SURFACE = 最高非空气方块; 顶部为流体时 MOTION_BLOCKING 与之相同而 OCEAN_FLOOR 更低
+                # 水和岩浆都符合这一特征, 这些列留给下面的逐块扫描按顶部方块判断
+                surface = stored["WORLD_SURFACE"][cols]
+                fluid = (stored["MOTION_BLOCKING"][cols] == surface) & (stored["OCEAN_FLOOR"][cols] < surface)
+                inside = (surface >= y_min) & (surface <= y_max)
+                unresolved = surface >= y_min
+                if mode in ("terrain", "solid"):
+                    out[inside & ~fluid] = surface[inside & ~fluid]
+                    unresolved &= ~(inside & ~fluid)
+                if not unresolved.any():
+                    continue
+                # 任何模式的结果都不会高于 WORLD_SURFACE
+                y_hi = min(y_max, int(surface[unresolved].max()))
+
+            view = RegionView(level, ax, y_min, az, bx, y_hi, bz, dim, ver)
+            found, ys, top_idx = _column_top(view, ~view.lookup(skip))
+            if mode == "terrain":
+                found &= ~view.lookup({"water"})[top_idx]
+            out[unresolved] = np.where(found, ys, HeightMap.NO_HEIGHT)[unresolved]
+    return HeightMap(heights, (min_x, min_z))
+
 def scan_terrain(level, cx, cz, dim, ver, radius=80, base_y=64):
-    """扫描以(cx,cz)为中心的地形, 返回 height_map: {(x,z): y}"""
-    height_map = {}
-    for x in range(cx - radius, cx + radius):
-        for z in range(cz - radius, cz + radius):
-            for y in range(base_y + 40, base_y - 40, -1):
-                bid = get_block(level, x, y, z, dim, ver)
-                if bid != "air":
-                    if bid != "water":
-                        height_map[(x, z)] = y
-                    break
-    return height_map
+    """扫描以(cx,cz)为中心的地形, 返回 height_map: {(x,z): y} (HeightMap)"""
+    return compute_heightmap(level, cx - radius, cz - radius, cx + radius - 1, cz + radius - 1,
+                             dim, ver, base_y - 39, base_y + 40, mode="terrain")
 
 def get_terrain_bounds(height_map):
     """从 height_map 获取地形边界, 返回 (min_x, max_x, min_z, max_z, min_y, max_y)"""
     if not height_map:
         return (0, 0, 0, 0, 0, 0)
+    if isinstance(height_map, HeightMap):
+        valid = height_map.valid
+        xs, zs = valid.nonzero()
+        ys = height_map.heights[valid]
+        ox, oz = height_map.origin
+        return (ox + int(xs.min()), ox + int(xs.max()), oz + int(zs.min()), oz + int(zs.max()),
+                int(ys.min()), int(ys.max()))
     xs = [k[0] for k in height_map]
     zs = [k[1] for k in height_map]
     ys = list(height_map.values())
@@ -401,29 +2052,9 @@ def get_terrain_bounds(height_map):
 
 def scan_ground(level, cx, cz, dim, ver, radius=80):
     """扫描真实地面高度, 跳过建筑方块和树叶, 只返回自然地面
-    返回 height_map: {(x,z): y}"""
-    height_map = {}
-    for x in range(cx - radius, cx + radius):
-        for z in range(cz - radius, cz + radius):
-            for y in range(100, 30, -1):
-                bid = get_block(level, x, y, z, dim, ver)
-                if bid == "air" or bid == "water":
-                    continue
-                if bid in BUILDING_BLOCKS:
-                    continue
-                # 跳过植被（花、草、蘑菇等短植物）
-                if bid in ("short_grass", "tall_grass", "fern", "large_fern",
-                           "dead_bush", "sweet_berry_bush", "seagrass",
-                           "sugar_cane", "bamboo", "vine", "kelp",
-                           "brown_mushroom", "red_mushroom") or bid in FLOWERS:
-                    continue
-                if bid in NATURAL_GROUND:
-                    height_map[(x, z)] = y
-                    break
-                # 未知方块：如果在自然地面集合外也不在建筑集合，保守当作地面
-                height_map[(x, z)] = y
-                break
-    return height_map
+    返回 height_map: {(x,z): y} (HeightMap)"""
+    return compute_heightmap(level, cx - radius, cz - radius, cx + radius - 1, cz + radius - 1,
+                             dim, ver, 31, 100, mode="ground")
 
 def flatten_area(level, x1, z1, x2, z2, target_y, dim, ver,
                  surface="grass_block", underground="dirt", clear_above=20,
@@ -439,14 +2070,17 @@ def flatten_area(level, x1, z1, x2, z2, target_y, dim, ver,
     min_z, max_z = min(z1, z2), max(z1, z2)
     surface_props = {"snowy": "false"} if surface == "grass_block" else None
 
-    # 核心区域平整
-    for x in range(min_x, max_x + 1):
-        for z in range(min_z, max_z + 1):
-            place_block(level, x, target_y, z, dim, ver, surface, surface_props)
-            for dy in range(1, clear_above + 1):
-                place_block(level, x, target_y + dy, z, dim, ver, "air")
-            for dy in range(1, 4):
-                place_block(level, x, target_y - dy, z, dim, ver, underground)
+    # 过渡带的自然高度在平整前一次算好 (平整只改核心区域, 不影响过渡带各列)
+    if blend_radius > 0:
+        natural = compute_heightmap(level, min_x - blend_radius, min_z - blend_radius,
+                                    max_x + blend_radius, max_z + blend_radius,
+                                    dim, ver, 31, 100, mode="solid")
+
+    # 核心区域平整: 地表、上方空气、下方 3 层填充各为一次长方体填充
+    _fill_box(level, min_x, target_y, min_z, max_x, target_y, max_z, dim, ver, surface, surface_props)
+    if clear_above > 0:
+        _fill_box(level, min_x, target_y + 1, min_z, max_x, target_y + clear_above, max_z, dim, ver, "air")
+    _fill_box(level, min_x, target_y - 3, min_z, max_x, target_y - 1, max_z, dim, ver, underground)
 
     # 边缘渐变过渡
     if blend_radius > 0:
@@ -462,13 +2096,8 @@ def flatten_area(level, x1, z1, x2, z2, target_y, dim, ver,
                 dist = math.sqrt(dx * dx + dz * dz)
                 if dist > blend_radius:
                     continue
-                # 读取该位置的自然地面高度
-                natural_y = None
-                for y in range(100, 30, -1):
-                    bid = get_block(level, x, y, z, dim, ver)
-                    if bid != "air" and bid != "water":
-                        natural_y = y
-                        break
+                # 该位置的自然地面高度
+                natural_y = natural.get((x, z))
                 if natural_y is None:
                     continue
                 # 线性插值
@@ -489,10 +2118,8 @@ def flatten_area(level, x1, z1, x2, z2, target_y, dim, ver,
 
 def clear_vegetation(level, x1, z1, x2, z2, y_base, dim, ver, height=25):
     """清除地面以上的植被(树木、花草等), 保留地面"""
-    for x in range(min(x1, x2), max(x1, x2) + 1):
-        for z in range(min(z1, z2), max(z1, z2) + 1):
-            for y in range(y_base + 1, y_base + height):
-                place_block(level, x, y, z, dim, ver, "air")
+    if height > 1:
+        _fill_box(level, x1, y_base + 1, z1, x2, y_base + height - 1, z2, dim, ver, "air")
 
 def build_smart_path(level, start, end, dim, ver, width=2, block="stone_bricks"):
     """A* 智能路径: 自动寻路, 避开建筑和树木, 沿地面铺设
@@ -514,6 +2141,10 @@ def build_smart_path(level, start, end, dim, ver, width=2, block="stone_bricks")
 
     # 检测哪些格子上方有建筑（用 scan_terrain 对比 scan_ground）
     blocked = set()
+    ys = [y for (x, z), y in ground.items() if min_x <= x <= max_x and min_z <= z <= max_z]
+    if ys:
+        view = RegionView(level, min_x, min(ys) + 1, min_z, max_x, max(ys) + 5, max_z, dim, ver)
+        building = view.lookup(BUILDING_BLOCKS)
     for x in range(min_x, max_x + 1):
         for z in range(min_z, max_z + 1):
             if (x, z) not in ground:
@@ -521,11 +2152,9 @@ def build_smart_path(level, start, end, dim, ver, width=2, block="stone_bricks")
                 continue
             gy = ground[(x, z)]
             # 检查地面上方是否有非自然方块（建筑）
-            for dy in range(1, 6):
-                bid = get_block(level, x, gy + dy, z, dim, ver)
-                if bid in BUILDING_BLOCKS:
-                    blocked.add((x, z))
-                    break
+            column = view.indices[x - min_x, gy + 1 - view.min_y:gy + 6 - view.min_y, z - min_z]
+            if building[column].any():
+                blocked.add((x, z))
 
     # A* 寻路
     def heuristic(a, b):
@@ -594,150 +2223,405 @@ def build_smart_path(level, start, end, dim, ver, width=2, block="stone_bricks")
         path.append((sx, ground.get(start_node, 64), sz))
         path.reverse()
 
-    # 铺设路径
+    # 铺设路径 (先一次读入路径范围, 本次已铺设的位置以 placed 为准)
     half_w = width // 2
+    view = RegionView(level, min(p[0] for p in path) - half_w, min(p[1] for p in path) + 1,
+                      min(p[2] for p in path) - half_w, max(p[0] for p in path) + half_w,
+                      max(p[1] for p in path) + 3, max(p[2] for p in path) + half_w, dim, ver)
+    placed = {}
     for px, py, pz in path:
         for ox in range(-half_w, half_w + 1):
             for oz in range(-half_w, half_w + 1):
                 # 清除路面上方低矮植被
                 for dy in range(1, 4):
-                    bid = get_block(level, px + ox, py + dy, pz + oz, dim, ver)
+                    pos = (px + ox, py + dy, pz + oz)
+                    bid = placed.get(pos) or view.name_at(*pos)
                     if bid not in ("air", "water"):
-                        place_block(level, px + ox, py + dy, pz + oz, dim, ver, "air")
+                        place_block(level, *pos, dim, ver, "air")
+                        placed[pos] = "air"
                 place_block(level, px + ox, py, pz + oz, dim, ver, block)
+                placed[(px + ox, py, pz + oz)] = block
 
     print(f"智能路径完成: {start} -> {end}, {len(path)} 格, 宽度 {width}")
     return path
 
+# ============================================
+# 形状掩码 (按参数缓存)
+# ============================================
+# 2D 掩码下标为 [dx + r, dz + r], 3D 掩码为 [dx, dy, dz] 相对包围盒最小角; 返回只读数组, 勿修改
+
+def _frozen(mask):
+    mask.setflags(write=False)
+    return mask
+
+@functools.lru_cache(maxsize=256)
+def _disc_dist(radius):
+    """(2r+1)x(2r+1) 网格上到中心的距离平方"""
+    import numpy as np
+
+    d = np.arange(-radius, radius + 1)
+    return _frozen(d[:, None] ** 2 + d[None, :] ** 2)
+
+@functools.lru_cache(maxsize=256)
+def disc_mask(radius):
+    """实心圆盘: dx²+dz² <= r²"""
+    return _frozen(_disc_dist(radius) <= radius * radius)
+
+@functools.lru_cache(maxsize=256)
+def ring_mask(radius):
+    """圆环 (宽 1): (r-1)² < dx²+dz² <= r²"""
+    dist = _disc_dist(radius)
+    return _frozen((dist <= radius * radius) & (dist > (radius - 1) * (radius - 1)))
+
+@functools.lru_cache(maxsize=256)
+def _hollow_disc_masks(radius):
+    """空心圆柱的一层: (外壁, 内部空气), 内部为 dx²+dz² < (r-1)²"""
+    dist = _disc_dist(radius)
+    hole = dist < (radius - 1) * (radius - 1)
+    return _frozen(disc_mask(radius) & ~hole), _frozen(hole)
+
+@functools.lru_cache(maxsize=64)
+def ellipsoid_mask(rx, ry, rz, hollow=False):
+    """椭球 (半轴 rx/ry/rz, 形状 (2rx+1, 2ry+1, 2rz+1)); hollow 时只保留 1 格厚的外壳"""
+    import numpy as np
+
+    x, y, z = np.ogrid[-rx:rx + 1, -ry:ry + 1, -rz:rz + 1]
+    inside = (x / (rx + 0.5)) ** 2 + (y / (ry + 0.5)) ** 2 + (z / (rz + 0.5)) ** 2 <= 1
+    if hollow:
+        # 6 邻居都在内部的格子为内核
+        core = inside.copy()
+        core[1:-1, 1:-1, 1:-1] &= (inside[:-2, 1:-1, 1:-1] & inside[2:, 1:-1, 1:-1]
+                                   & inside[1:-1, :-2, 1:-1] & inside[1:-1, 2:, 1:-1]
+                                   & inside[1:-1, 1:-1, :-2] & inside[1:-1, 1:-1, 2:])
+        core[[0, -1], :, :] = core[:, [0, -1], :] = core[:, :, [0, -1]] = False
+        inside &= ~core
+    return _frozen(inside)
+
+def sphere_mask(radius, hollow=False):
+    """球体, 形状 (2r+1)³"""
+    return ellipsoid_mask(radius, radius, radius, hollow)
+
+@functools.lru_cache(maxsize=64)
+def torus_mask(major, minor):
+    """圆环体 (环面在水平面): 形状 (2(R+r)+1, 2r+1, 2(R+r)+1)"""
+    import numpy as np
+
+    extent = major + minor
+    x, y, z = np.ogrid[-extent:extent + 1, -minor:minor + 1, -extent:extent + 1]
+    ring = np.sqrt(x * x + z * z) - major
+    return _frozen(ring * ring + y * y <= (minor + 0.5) ** 2)
+
+def _write_points(level, xs, ys, zs, dim, ver, block, props=None):
+    """把一组坐标写成同一方块: BlockWriter 整批 set_many, BuildPlan 逐个记录, 原始 level 临时套 BlockWriter"""
+    state = _BLOCK_CACHE.get(block, props, ver)
+    if isinstance(level, BuildPlan):
+        for x, y, z in zip(xs.tolist(), ys.tolist(), zs.tolist()):
+            level.set_version_block(x, y, z, dim, ver, state)
+    elif isinstance(level, BlockWriter):
+        level.set_many(xs, ys, zs, dim, ver, state)
+    else:
+        with BlockWriter(level) as writer:
+            writer.set_many(xs, ys, zs, dim, ver, state)
+
+def _stamp(level, mask, x0, y0, z0, dim, ver, block, props=None, layers=1):
+    """把掩码盖到世界中: 最小角为 (x0, y0, z0); 2D 掩码在 y0.. y0+layers-1 逐层重复"""
+    import numpy as np
+
+    if mask.ndim == 2:
+        px, pz = np.nonzero(mask)
+        n = len(px)
+        xs, zs = np.tile(px + x0, layers), np.tile(pz + z0, layers)
+        ys = np.repeat(np.arange(y0, y0 + layers), n)
+    else:
+        px, py, pz = np.nonzero(mask)
+        xs, ys, zs = px + x0, py + y0, pz + z0
+    if len(xs):
+        _write_points(level, xs, ys, zs, dim, ver, block, props)
+
 # ============================================
 # 基础建筑原语
 # ============================================
 
+def _fill_box(level, x1, y1, z1, x2, y2, z2, dim, ver, block, props=None):
+    """原语共用的长方体填充: BuildPlan 记录为 fill 操作, 其他情况经 BlockWriter.fill_box 整块写入"""
+    if isinstance(level, BuildPlan):
+        level.fill(x1, y1, z1, x2, y2, z2, dim, ver, block, props)
+        return
+    state = _BLOCK_CACHE.get(block, props, ver)
+    if isinstance(level, BlockWriter):
+        level.fill_box(x1, y1, z1, x2, y2, z2, dim, ver, state)
+        return
+    with BlockWriter(level) as writer:
+        writer.fill_box(x1, y1, z1, x2, y2, z2, dim, ver, state)
+
+def _shell_faces(min_x, min_y, min_z, max_x, max_y, max_z):
+    """空心长方体的六个面, 拆成互不重叠的长方体"""
+    faces = [(min_x, min_y, min_z, max_x, min_y, max_z)]
+    if max_y > min_y:
+        faces.append((min_x, max_y, min_z, max_x, max_y, max_z))
+    if max_y - min_y > 1:
+        y1, y2 = min_y + 1, max_y - 1
+        faces.append((min_x, y1, min_z, min_x, y2, max_z))
+        if max_x > min_x:
+            faces.append((max_x, y1, min_z, max_x, y2, max_z))
+        if max_x - min_x > 1:
+            faces.append((min_x + 1, y1, min_z, max_x - 1, y2, min_z))
+            if max_z > min_z:
+                faces.append((min_x + 1, y1, max_z, max_x - 1, y2, max_z))
+    return faces
+
 def build_box(level, x1, y1, z1, x2, y2, z2, dim, ver, block, props=None, hollow=False):
-    """建造方块盒子(实心或空心)"""
-    for x in range(min(x1,x2), max(x1,x2)+1):
-        for y in range(min(y1,y2), max(y1,y2)+1):
-            for z in range(min(z1,z2), max(z1,z2)+1):
-                if hollow:
-                    is_edge_x = (x == min(x1,x2) or x == max(x1,x2))
-                    is_edge_y = (y == min(y1,y2) or y == max(y1,y2))
-                    is_edge_z = (z == min(z1,z2) or z == max(z1,z2))
-                    if not (is_edge_x or is_edge_y or is_edge_z):
-                        place_block(level, x, y, z, dim, ver, "air")
-                        continue
-                place_block(level, x, y, z, dim, ver, block, props)
+    """建造方块盒子(实心或空心), 空心时内部填充空气"""
+    if isinstance(level, BuildPlan):
+        (level.shell if hollow else level.fill)(x1, y1, z1, x2, y2, z2, dim, ver, block, props)
+        return
+    min_x, max_x = min(x1, x2), max(x1, x2)
+    min_y, max_y = min(y1, y2), max(y1, y2)
+    min_z, max_z = min(z1, z2), max(z1, z2)
+    if not hollow:
+        _fill_box(level, min_x, min_y, min_z, max_x, max_y, max_z, dim, ver, block, props)
+        return
+    if max_x - min_x > 1 and max_y - min_y > 1 and max_z - min_z > 1:
+        _fill_box(level, min_x + 1, min_y + 1, min_z + 1, max_x - 1, max_y - 1, max_z - 1, dim, ver, "air")
+    for face in _shell_faces(min_x, min_y, min_z, max_x, max_y, max_z):
+        _fill_box(level, *face, dim, ver, block, props)
 
 def build_walls(level, x1, y1, z1, x2, y2, z2, dim, ver, wall_block, corner_block=None, props=None):
     """建造四面墙壁(不含地板和天花板), 可指定角柱材料"""
     corner = corner_block or wall_block
-    for y in range(min(y1,y2), max(y1,y2)+1):
-        for x in range(min(x1,x2), max(x1,x2)+1):
-            for z in range(min(z1,z2), max(z1,z2)+1):
-                is_edge_x = (x == min(x1,x2) or x == max(x1,x2))
-                is_edge_z = (z == min(z1,z2) or z == max(z1,z2))
-                if is_edge_x and is_edge_z:
-                    place_block(level, x, y, z, dim, ver, corner, props)
-                elif is_edge_x or is_edge_z:
-                    place_block(level, x, y, z, dim, ver, wall_block, props)
+    min_x, max_x, min_z, max_z = min(x1,x2), max(x1,x2), min(z1,z2), max(z1,z2)
+    min_y, max_y = min(y1, y2), max(y1, y2)
+    for x in {min_x, max_x}:
+        for z in {min_z, max_z}:
+            _fill_box(level, x, min_y, z, x, max_y, z, dim, ver, corner, props)
+        if max_z - min_z > 1:
+            _fill_box(level, x, min_y, min_z + 1, x, max_y, max_z - 1, dim, ver, wall_block, props)
+    if max_x - min_x > 1:
+        for z in {min_z, max_z}:
+            _fill_box(level, min_x + 1, min_y, z, max_x - 1, max_y, z, dim, ver, wall_block, props)
 
 def build_floor(level, x1, y1, z1, x2, z2, dim, ver, block, props=None, checkerboard=None):
     """建造地板, 可选棋盘格花纹"""
+    _fill_box(level, x1, y1, z1, x2, y1, z2, dim, ver, block, props)
+    if not checkerboard:
+        return
     for x in range(min(x1,x2), max(x1,x2)+1):
         for z in range(min(z1,z2), max(z1,z2)+1):
-            if checkerboard and (x + z) % 2 == 1:
+            if (x + z) % 2 == 1:
                 place_block(level, x, y1, z, dim, ver, checkerboard)
-            else:
-                place_block(level, x, y1, z, dim, ver, block, props)
 
 def build_circle(level, cx, y, cz, radius, dim, ver, block, props=None, fill=False):
     """在水平面上建造一个圆形(环或实心圆盘)"""
-    for dx in range(-radius, radius + 1):
-        for dz in range(-radius, radius + 1):
-            dist_sq = dx*dx + dz*dz
-            if fill:
-                if dist_sq <= radius * radius:
-                    place_block(level, cx + dx, y, cz + dz, dim, ver, block, props)
-            else:
-                if dist_sq <= radius * radius and dist_sq > (radius - 1) * (radius - 1):
-                    place_block(level, cx + dx, y, cz + dz, dim, ver, block, props)
+    _stamp(level, disc_mask(radius) if fill else ring_mask(radius),
+           cx - radius, y, cz - radius, dim, ver, block, props)
 
 def build_cylinder(level, cx, cz, y1, y2, radius, dim, ver, block, props=None, hollow=True):
     """建造圆柱体(实心或空心)"""
-    for y in range(min(y1, y2), max(y1, y2) + 1):
-        for dx in range(-radius, radius + 1):
-            for dz in range(-radius, radius + 1):
-                dist_sq = dx*dx + dz*dz
-                if dist_sq <= radius * radius:
-                    if hollow and dist_sq < (radius - 1) * (radius - 1):
-                        place_block(level, cx + dx, y, cz + dz, dim, ver, "air")
-                    else:
-                        place_block(level, cx + dx, y, cz + dz, dim, ver, block, props)
+    if isinstance(level, BuildPlan):
+        level.cylinder(cx, cz, y1, y2, radius, dim, ver, block, props, hollow)
+        return
+    y0, layers = min(y1, y2), abs(y2 - y1) + 1
+    if not hollow:
+        _stamp(level, disc_mask(radius), cx - radius, y0, cz - radius, dim, ver, block, props, layers)
+        return
+    wall, hole = _hollow_disc_masks(radius)
+    _stamp(level, hole, cx - radius, y0, cz - radius, dim, ver, "air", layers=layers)
+    _stamp(level, wall, cx - radius, y0, cz - radius, dim, ver, block, props, layers)
+
+def build_cone(level, cx, cz, y_base, radius, height, dim, ver, block, props=None):
+    """建造圆锥体/锥形屋顶"""
+    import numpy as np
+
+    parts = []
+    for i in range(height):
+        r = radius * (1 - i / height)
+        if r < 0.5:
+            parts.append((np.array([cx]), np.array([y_base + i]), np.array([cz])))
+            break
+        r = int(r)
+        px, pz = np.nonzero(disc_mask(r))
+        parts.append((px + cx - r, np.full(len(px), y_base + i), pz + cz - r))
+    if parts:
+        xs, ys, zs = (np.concatenate(a) for a in zip(*parts))
+        _write_points(level, xs, ys, zs, dim, ver, block, props)
 
 def build_arch(level, x, y_base, z1, z2, height, dim, ver, block, props=None):
     """在x固定的平面上建造一个拱门(沿z轴)"""
-    span = abs(z2 - z1)
-    mid_z = (z1 + z2) / 2.0
-    half = span / 2.0
-
+    import numpy as np
+
+    lo, hi = min(z1, z2), max(z1, z2)
+    half = (hi - lo) / 2.0
+    zs = np.arange(lo, hi + 1)
+    top = y_base + height
+    # 拱形顶部 (半椭圆), 每列从柱顶填到拱顶
+    if half > 0:
+        dz = np.abs(zs - (lo + hi) / 2.0)
+        arch_y = top + ((height * 0.5) * np.sqrt(np.maximum(0, 1 - (dz / half) ** 2))).astype(np.int64)
+    else:
+        arch_y = np.full(len(zs), top)
+    counts = arch_y - top + 1
+    col_z = np.repeat(zs, counts)
+    col_y = top + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
     # 两侧柱子
-    for y in range(y_base, y_base + height):
-        place_block(level, x, y, min(z1, z2), dim, ver, block, props)
-        place_block(level, x, y, max(z1, z2), dim, ver, block, props)
-
-    # 拱形顶部 (半椭圆)
-    for z in range(min(z1, z2), max(z1, z2) + 1):
-        dz = abs(z - mid_z)
-        if half > 0:
-            arch_y = y_base + height + int((height * 0.5) * math.sqrt(max(0, 1 - (dz / half) ** 2)))
-        else:
-            arch_y = y_base + height
-        place_block(level, x, arch_y, z, dim, ver, block, props)
-        # 填充柱子到拱顶之间
-        for y in range(y_base + height, arch_y):
-            place_block(level, x, y, z, dim, ver, block, props)
+    pillar_y = np.arange(y_base, top)
+    ys = np.concatenate([pillar_y, pillar_y, col_y])
+    zs = np.concatenate([np.full(len(pillar_y), lo), np.full(len(pillar_y), hi), col_z])
+    _write_points(level, np.full(len(ys), x), ys, zs, dim, ver, block, props)
 
 def build_pitched_roof(level, x1, y1, z1, x2, z2, dim, ver, stair_block, slab_block, axis="z"):
-    """建造斜屋顶 (axis='z'沿z轴升高, 'x'沿x轴升高)"""
+    """建造斜屋顶 (axis='z'沿z轴升高, 'x'沿x轴升高), 每排台阶为一次长方体填充"""
     min_x, max_x = min(x1,x2), max(x1,x2)
     min_z, max_z = min(z1,z2), max(z1,z2)
+    slab = {"type": "top", "waterlogged": "false"}
+
+    def stair(facing):
+        return {"facing": facing, "half": "bottom", "shape": "straight", "waterlogged": "false"}
 
     if axis == "z":
-        half_d = (max_z - min_z) // 2
-        for i in range(half_d + 1):
+        for i in range((max_z - min_z) // 2 + 1):
             y = y1 + i
             if min_z + i >= max_z - i:
-                for x in range(min_x, max_x + 1):
-                    place_block(level, x, y, min_z + i, dim, ver, slab_block,
-                                {"type": "top", "waterlogged": "false"})
+                _fill_box(level, min_x, y, min_z + i, max_x, y, min_z + i, dim, ver, slab_block, slab)
                 break
-            for x in range(min_x, max_x + 1):
-                place_block(level, x, y, min_z + i, dim, ver, stair_block,
-                            {"facing": "south", "half": "bottom", "shape": "straight", "waterlogged": "false"})
-                place_block(level, x, y, max_z - i, dim, ver, stair_block,
-                            {"facing": "north", "half": "bottom", "shape": "straight", "waterlogged": "false"})
+            _fill_box(level, min_x, y, min_z + i, max_x, y, min_z + i, dim, ver, stair_block, stair("south"))
+            _fill_box(level, min_x, y, max_z - i, max_x, y, max_z - i, dim, ver, stair_block, stair("north"))
     else:
-        half_w = (max_x - min_x) // 2
-        for i in range(half_w + 1):
+        for i in range((max_x - min_x) // 2 + 1):
             y = y1 + i
             if min_x + i >= max_x - i:
-                for z in range(min_z, max_z + 1):
-                    place_block(level, min_x + i, y, z, dim, ver, slab_block,
-                                {"type": "top", "waterlogged": "false"})
+                _fill_box(level, min_x + i, y, min_z, min_x + i, y, max_z, dim, ver, slab_block, slab)
                 break
-            for z in range(min_z, max_z + 1):
-                place_block(level, min_x + i, y, z, dim, ver, stair_block,
-                            {"facing": "east", "half": "bottom", "shape": "straight", "waterlogged": "false"})
-                place_block(level, max_x - i, y, z, dim, ver, stair_block,
-                            {"facing": "west", "half": "bottom", "shape": "straight", "waterlogged": "false"})
+            _fill_box(level, min_x + i, y, min_z, min_x + i, y, max_z, dim, ver, stair_block, stair("east"))
+            _fill_box(level, max_x - i, y, min_z, max_x - i, y, max_z, dim, ver, stair_block, stair("west"))
 
-def build_cone(level, cx, cz, y_base, radius, height, dim, ver, block, props=None):
-    """建造圆锥体/锥形屋顶"""
-    for i in range(height):
-        r = radius * (1 - i / height)
-        if r < 0.5:
-            place_block(level, cx, y_base + i, cz, dim, ver, block, props)
-            break
-        build_circle(level, cx, y_base + i, cz, int(r), dim, ver, block, props, fill=True)
+def build_sphere(level, cx, cy, cz, radius, dim, ver, block, props=None, hollow=False):
+    """建造球体 (hollow: 1 格厚球壳, 内部不动)"""
+    _stamp(level, sphere_mask(radius, hollow), cx - radius, cy - radius, cz - radius, dim, ver, block, props)
+
+def build_ellipsoid(level, cx, cy, cz, rx, ry, rz, dim, ver, block, props=None, hollow=False):
+    """建造椭球 (半轴 rx/ry/rz), 可做穹顶、山丘等"""
+    _stamp(level, ellipsoid_mask(rx, ry, rz, hollow), cx - rx, cy - ry, cz - rz, dim, ver, block, props)
+
+def build_torus(level, cx, cy, cz, major, minor, dim, ver, block, props=None):
+    """建造水平圆环体: major 为环中心半径, minor 为管半径"""
+    extent = major + minor
+    _stamp(level, torus_mask(major, minor), cx - extent, cy - minor, cz - extent, dim, ver, block, props)
+
+# ============================================
+# SDF 体积建造 (有符号距离场)
+# ============================================
+
+class SDF:
+    """有符号距离场: sdf(x, y, z) 对 NumPy 数组逐点求值, <= 0 为内部
+    lo / hi 为包围盒 (x, y, z) 浮点角点; 用 | (并)、- (差)、& (交)、.shell() 组合:
+        dome = sdf_sphere((0, 64, 0), 20).shell(2) - sdf_box((0, 44, 0), (21, 20, 21))"""
+
+    def __init__(self, fn, lo, hi):
+        self.fn = fn
+        self.lo = tuple(lo)
+        self.hi = tuple(hi)
+
+    def __call__(self, x, y, z):
+        return self.fn(x, y, z)
+
+    def __or__(self, other):
+        import numpy as np
+        return SDF(lambda x, y, z: np.minimum(self(x, y, z), other(x, y, z)),
+                   map(min, self.lo, other.lo), map(max, self.hi, other.hi))
+
+    def __and__(self, other):
+        import numpy as np
+        return SDF(lambda x, y, z: np.maximum(self(x, y, z), other(x, y, z)),
+                   map(max, self.lo, other.lo), map(min, self.hi, other.hi))
+
+    def __sub__(self, other):
+        import numpy as np
+        return SDF(lambda x, y, z: np.maximum(self(x, y, z), -other(x, y, z)), self.lo, self.hi)
+
+    def shell(self, thickness=1):
+        """只保留表面附近厚 thickness 的一层"""
+        import numpy as np
+        half = thickness / 2.0
+        return SDF(lambda x, y, z: np.abs(self(x, y, z)) - half,
+                   (v - half for v in self.lo), (v + half for v in self.hi))
+
+    def translate(self, dx, dy, dz):
+        return SDF(lambda x, y, z: self(x - dx, y - dy, z - dz),
+                   (self.lo[0] + dx, self.lo[1] + dy, self.lo[2] + dz),
+                   (self.hi[0] + dx, self.hi[1] + dy, self.hi[2] + dz))
+
+def sdf_sphere(center, radius):
+    """球"""
+    import numpy as np
+    cx, cy, cz = center
+    return SDF(lambda x, y, z: np.sqrt((x - cx) ** 2 + (y - cy) ** 2 + (z - cz) ** 2) - radius,
+               (cx - radius, cy - radius, cz - radius), (cx + radius, cy + radius, cz + radius))
+
+def sdf_box(center, half):
+    """轴对齐长方体, half 为 (x, y, z) 半边长"""
+    import numpy as np
+    (cx, cy, cz), (hx, hy, hz) = center, half
+
+    def fn(x, y, z):
+        qx, qy, qz = np.abs(x - cx) - hx, np.abs(y - cy) - hy, np.abs(z - cz) - hz
+        outside = np.sqrt(np.maximum(qx, 0) ** 2 + np.maximum(qy, 0) ** 2 + np.maximum(qz, 0) ** 2)
+        return outside + np.minimum(np.maximum(np.maximum(qx, qy), qz), 0)
+    return SDF(fn, (cx - hx, cy - hy, cz - hz), (cx + hx, cy + hy, cz + hz))
+
+def sdf_capsule(a, b, radius):
+    """胶囊: 线段 a-b 周围半径 radius 的区域 (柱子、拱肋、树枝)"""
+    import numpy as np
+    (ax, ay, az), (bx, by, bz) = a, b
+    ux, uy, uz = bx - ax, by - ay, bz - az
+    length_sq = max(ux * ux + uy * uy + uz * uz, 1e-9)
+
+    def fn(x, y, z):
+        px, py, pz = x - ax, y - ay, z - az
+        t = np.clip((px * ux + py * uy + pz * uz) / length_sq, 0.0, 1.0)
+        return np.sqrt((px - t * ux) ** 2 + (py - t * uy) ** 2 + (pz - t * uz) ** 2) - radius
+    return SDF(fn, (min(ax, bx) - radius, min(ay, by) - radius, min(az, bz) - radius),
+               (max(ax, bx) + radius, max(ay, by) + radius, max(az, bz) + radius))
+
+def sdf_ellipsoid(center, radii):
+    """椭球 (近似距离, 表面位置精确)"""
+    import numpy as np
+    (cx, cy, cz), (rx, ry, rz) = center, radii
+
+    def fn(x, y, z):
+        px, py, pz = x - cx, y - cy, z - cz
+        k0 = np.sqrt((px / rx) ** 2 + (py / ry) ** 2 + (pz / rz) ** 2)
+        k1 = np.sqrt((px / rx ** 2) ** 2 + (py / ry ** 2) ** 2 + (pz / rz ** 2) ** 2)
+        return np.where(k1 > 0, k0 * (k0 - 1) / np.maximum(k1, 1e-9), -min(rx, ry, rz))
+    return SDF(fn, (cx - rx, cy - ry, cz - rz), (cx + rx, cy + ry, cz + rz))
+
+def sdf_torus(center, major, minor):
+    """水平圆环体"""
+    import numpy as np
+    cx, cy, cz = center
+    extent = major + minor
+    return SDF(lambda x, y, z: np.sqrt((np.sqrt((x - cx) ** 2 + (z - cz) ** 2) - major) ** 2 + (y - cy) ** 2) - minor,
+               (cx - extent, cy - minor, cz - extent), (cx + extent, cy + minor, cz + extent))
+
+@_batched
+def build_sdf(level, shape, dim, ver, block, props=None):
+    """按 SDF 填充方块: 在包围盒内的整数坐标上求值 (16 宽 x 切片, 内存有界), <= 0 的格子写入 block
+    返回写入方块数"""
+    import numpy as np
+
+    lo = [math.floor(v) for v in shape.lo]
+    hi = [math.ceil(v) for v in shape.hi]
+    if any(a > b for a, b in zip(lo, hi)):
+        return 0
+    count = 0
+    for x0 in range((lo[0] >> 4) << 4, hi[0] + 1, 16):
+        xa, xb = max(x0, lo[0]), min(x0 + 15, hi[0])
+        x, y, z = np.mgrid[xa:xb + 1, lo[1]:hi[1] + 1, lo[2]:hi[2] + 1]
+        inside = shape(x, y, z) <= 0
+        if inside.any():
+            _write_points(level, x[inside], y[inside], z[inside], dim, ver, block, props)
+            count += int(inside.sum())
+    print(f"SDF 建造完成: {count} 个方块")
+    return count
 
 # ============================================
 # 家具与装饰
@@ -815,6 +2699,7 @@ def build_path(level, x1, z1, x2, z2, y, dim, ver, width=1, block="dirt_path"):
 # 预设建筑模板
 # ============================================
 
+@_batched
 def build_simple_house(level, bx, by, bz, dim, ver, w=7, h=5, d=7):
     """建造简易木屋 (含家具)"""
     build_floor(level, bx, by-1, bz, bx+w-1, bz+d-1, dim, ver, "cobblestone")
@@ -841,6 +2726,7 @@ def build_simple_house(level, bx, by, bz, dim, ver, w=7, h=5, d=7):
     place_block(level, bx-1, by, dz, dim, ver, "oak_stairs", {"facing": "east", "half": "bottom", "shape": "straight", "waterlogged": "false"})
     print(f"木屋建造完成: ({bx},{by},{bz}) 大小 {w}x{h}x{d}")
 
+@_batched
 def build_skyscraper(level, bx, by, bz, dim, ver, w=15, d=15, floors=12, floor_h=5):
     """建造玻璃幕墙摩天大楼"""
     H = floors * floor_h
@@ -918,6 +2804,7 @@ def build_skyscraper(level, bx, by, bz, dim, ver, w=15, d=15, floors=12, floor_h
     place_block(level, bcx, top_y+9, bcz, dim, ver, "lightning_rod")
     print(f"摩天大楼建造完成: ({bx},{by},{bz}) {w}x{H}x{d} ({floors}层)")
 
+@_batched
 def build_cottage(level, bx, by, bz, dim, ver, w=8, d=7, h=4,
                   wall="oak_planks", roof_stair="dark_oak_stairs", roof_slab="dark_oak_slab",
                   log="oak_log", facing="south", name="小屋"):
@@ -988,6 +2875,7 @@ def build_cottage(level, bx, by, bz, dim, ver, w=8, d=7, h=4,
     print(f"  {name}完成!")
     return (mid_x, mid_z)
 
+@_batched
 def build_windmill(level, cx, by, cz, dim, ver, height=15, radius=3):
     """建造风车"""
     flatten_area(level, cx - radius - 2, cz - radius - 2, cx + radius + 2, cz + radius + 2, by, dim, ver)
@@ -997,10 +2885,7 @@ def build_windmill(level, cx, by, cz, dim, ver, height=15, radius=3):
         build_circle(level, cx, y, cz, r, dim, ver,
                      "cobblestone" if y < by + 3 else "white_concrete", fill=True)
         if r > 1:
-            for dx in range(-r + 1, r):
-                for dz in range(-r + 1, r):
-                    if dx*dx + dz*dz < (r-1) * (r-1):
-                        place_block(level, cx + dx, y, cz + dz, dim, ver, "air")
+            _stamp(level, _hollow_disc_masks(r)[1], cx - r, y, cz - r, dim, ver, "air")
 
     place_door(level, cx, by + 1, cz + radius, dim, ver, "oak", "south")
 
@@ -1012,13 +2897,11 @@ def build_windmill(level, cx, by, cz, dim, ver, height=15, radius=3):
                         {"north": "false", "south": "false", "east": "false", "west": "false", "waterlogged": "false"})
             place_block(level, cx + wool_dx, blade_y + wool_dy, blade_z, dim, ver, "white_wool")
 
-    for dx in range(-radius - 1, radius + 2):
-        for dz in range(-radius - 1, radius + 2):
-            if dx*dx + dz*dz <= (radius + 1) ** 2:
-                place_block(level, cx + dx, by + height, cz + dz, dim, ver, "dark_oak_planks")
+    build_circle(level, cx, by + height, cz, radius + 1, dim, ver, "dark_oak_planks", fill=True)
     place_block(level, cx, by + height + 1, cz, dim, ver, "dark_oak_planks")
     print(f"风车建造完成: ({cx},{by},{cz})")
 
+@_batched
 def build_farm(level, bx, by, bz, dim, ver, w=20, d=16, crops=None):
     """建造围栏农田 (自动灌溉水渠)"""
     if crops is None:
@@ -1060,6 +2943,7 @@ def build_farm(level, bx, by, bz, dim, ver, w=20, d=16, crops=None):
 
     print(f"农田建造完成: ({bx},{by},{bz}) {w}x{d}")
 
+@_batched
 def build_dock(level, bx, by, bz, dim, ver, length=18, width=5):
     """建造木码头 (延伸入水)"""
     half_w = width // 2
@@ -1084,6 +2968,48 @@ def build_dock(level, bx, by, bz, dim, ver, length=18, width=5):
 # 结构扫描 / 模板系统
 # ============================================
 
+# ---------- 方块实体 (箱子/告示牌/刷怪笼等的 NBT) ----------
+# 模板中以旁表 block_entities 存储: {位置索引: SNBT}, 位置索引 = (rx * sy + ry) * sz + rz
+
+def _block_entity_snbt(block_entity):
+    """版本 BlockEntity -> 含 id 的 SNBT 字符串"""
+    from amulet_nbt import StringTag
+
+    compound = block_entity.nbt.compound
+    compound["id"] = StringTag(f"{block_entity.namespace}:{block_entity.base_name}")
+    return compound.to_snbt()
+
+def _block_entity_from_snbt(snbt, x, y, z):
+    """SNBT -> 位于 (x, y, z) 的版本 BlockEntity"""
+    from amulet.api.block_entity import BlockEntity
+    from amulet_nbt import NamedTag, from_snbt
+
+    compound = from_snbt(snbt)
+    namespace, _, base_name = compound.pop("id").py_str.rpartition(":")
+    return BlockEntity(namespace or "minecraft", base_name, x, y, z, NamedTag(compound))
+
+def _scan_block_entities(level, min_x, min_y, min_z, max_x, max_y, max_z, dim, ver):
+    """读取包围盒内所有方块实体, 返回 {位置索引: SNBT}"""
+    from amulet.api.errors import ChunkDoesNotExist, ChunkLoadError
+
+    level = _unwrap_level(level)
+    sy, sz = max_y - min_y + 1, max_z - min_z + 1
+    table = {}
+    for cx in range(min_x >> 4, (max_x >> 4) + 1):
+        for cz in range(min_z >> 4, (max_z >> 4) + 1):
+            try:
+                chunk = level.get_chunk(cx, cz, dim)
+            except (ChunkDoesNotExist, ChunkLoadError):
+                continue
+            for x, y, z in list(chunk.block_entities):
+                if not (min_x <= x <= max_x and min_y <= y <= max_y and min_z <= z <= max_z):
+                    continue
+                _, block_entity = level.get_version_block(x, y, z, dim, ver)
+                if block_entity is not None:
+                    idx = ((x - min_x) * sy + (y - min_y)) * sz + (z - min_z)
+                    table[idx] = _block_entity_snbt(block_entity)
+    return table
+
 def scan_structure(level, x1, y1, z1, x2, y2, z2, dim, ver):
     """扫描指定范围内所有非空气方块, 返回模板数据
     坐标转为相对坐标 (相对于 x1,y1,z1)"""
@@ -1094,26 +3020,31 @@ def scan_structure(level, x1, y1, z1, x2, y2, z2, dim, ver):
     dy = max_y - min_y + 1
     dz = max_z - min_z + 1
 
+    view = RegionView(level, min_x, min_y, min_z, max_x, max_y, max_z, dim, ver)
+    # 每个调色板状态只提取一次属性
+    palette_props = []
+    for block in view.blocks:
+        props = {}
+        if hasattr(block, 'properties'):
+            for k, v in block.properties.items():
+                props[k] = str(v)
+        palette_props.append(props)
+
+    entities = _scan_block_entities(level, min_x, min_y, min_z, max_x, max_y, max_z, dim, ver)
     blocks = []
-    for x in range(min_x, max_x + 1):
-        for y in range(min_y, max_y + 1):
-            for z in range(min_z, max_z + 1):
-                block, _ = level.get_version_block(x, y, z, dim, ver)
-                name = block.base_name
-                if name == "air":
-                    continue
-                entry = {
-                    "pos": [x - min_x, y - min_y, z - min_z],
-                    "name": name,
-                }
-                # 提取方块属性
-                props = {}
-                if hasattr(block, 'properties'):
-                    for k, v in block.properties.items():
-                        props[k] = str(v)
-                if props:
-                    entry["props"] = props
-                blocks.append(entry)
+    solid = ~view.lookup({"air"})[view.indices]
+    for rx, ry, rz in zip(*solid.nonzero()):
+        idx = view.indices[rx, ry, rz]
+        entry = {
+            "pos": [int(rx), int(ry), int(rz)],
+            "name": view.palette[idx],
+        }
+        if palette_props[idx]:
+            entry["props"] = dict(palette_props[idx])
+        snbt = entities.get((int(rx) * dy + int(ry)) * dz + int(rz))
+        if snbt is not None:
+            entry["nbt"] = snbt
+        blocks.append(entry)
 
     template = {
         "size": [dx, dy, dz],
@@ -1127,33 +3058,666 @@ def scan_structure(level, x1, y1, z1, x2, y2, z2, dim, ver):
     print(f"扫描完成: {dx}x{dy}x{dz}, {len(blocks)} 个方块")
     return template
 
-def save_template(template, filepath=None, name=None):
-    """保存模板到 JSON 文件
-    filepath: 完整路径, 或 name: 自动保存到 templates 目录"""
+def scan_palette(level, x1, y1, z1, x2, y2, z2, dim, ver):
+    """扫描区域, 直接返回调色板模板 (不生成逐方块字典列表)
+    可直接 save_template 为 .mcbt / .nbt, 或 paste_structure"""
+    import numpy as np
+
+    min_x, max_x = min(x1, x2), max(x1, x2)
+    min_y, max_y = min(y1, y2), max(y1, y2)
+    min_z, max_z = min(z1, z2), max(z1, z2)
+
+    view = RegionView(level, min_x, min_y, min_z, max_x, max_y, max_z, dim, ver)
+    air = view.lookup({"air"})
+    palette = [None]
+    remap = np.zeros(len(view.palette), dtype=np.uint32)
+    for idx, block in enumerate(view.blocks):
+        if air[idx]:
+            continue
+        props = {}
+        if hasattr(block, 'properties'):
+            for k, v in block.properties.items():
+                props[k] = str(v)
+        remap[idx] = len(palette)
+        palette.append({"name": view.palette[idx], "props": props})
+    indices = remap[view.indices].astype(_palette_dtype(len(palette)))
+
+    template = {
+        "size": list(indices.shape),
+        "block_count": int(np.count_nonzero(indices)),
+        "palette": palette,
+        "indices": indices,
+        "block_entities": _scan_block_entities(level, min_x, min_y, min_z, max_x, max_y, max_z, dim, ver),
+        "meta": {
+            "scanned_from": [min_x, min_y, min_z],
+            "scanned_to": [max_x, max_y, max_z],
+        }
+    }
+    dx, dy, dz = template["size"]
+    print(f"扫描完成: {dx}x{dy}x{dz}, {template['block_count']} 个方块")
+    return template
+
+def scan_to_file(level, x1, y1, z1, x2, y2, z2, dim, ver, filepath=None, name=None, resume=True):
+    """流式扫描大区域, 逐区块列把调色板索引直接写入磁盘上的 .mcbt (不压缩, uint16 索引)
+    内存只占一个区块列 (加调色板); 新调色板项与方块实体追加到 <文件>.palette / <文件>.entities,
+    <文件>.progress 只记录进度与两者的字节位置, 中断后以相同参数再次调用即可续扫
+    返回 filepath"""
+    import struct
+    import time
+    import numpy as np
+
     if filepath is None:
         if name is None:
             name = f"template_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         os.makedirs(TEMPLATES_DIR, exist_ok=True)
-        filepath = os.path.join(TEMPLATES_DIR, f"{name}.json")
-    with open(filepath, "w") as f:
-        json.dump(template, f, indent=2)
+        filepath = os.path.join(TEMPLATES_DIR, f"{name}.mcbt")
+    min_x, max_x = min(x1, x2), max(x1, x2)
+    min_y, max_y = min(y1, y2), max(y1, y2)
+    min_z, max_z = min(z1, z2), max(z1, z2)
+    shape = (max_x - min_x + 1, max_y - min_y + 1, max_z - min_z + 1)
+    region = [min_x, min_y, min_z, max_x, max_y, max_z]
+    columns = [(cx, cz) for cx in range(min_x >> 4, (max_x >> 4) + 1)
+               for cz in range(min_z >> 4, (max_z >> 4) + 1)]
+    header_size = struct.calcsize(_MCBT_HEADER)
+    progress_path = filepath + ".progress"
+    palette_path = filepath + ".palette"
+    entities_path = filepath + ".entities"
+
+    state = None
+    if resume and all(os.path.exists(p) for p in (progress_path, filepath, palette_path, entities_path)):
+        with open(progress_path) as f:
+            state = json.load(f)
+        if state.get("region") != region or state.get("dimension") != dim or "palette_bytes" not in state:
+            state = None
+    if state is None:
+        state = {"region": region, "dimension": dim, "done": 0, "block_count": 0,
+                 "palette_bytes": 0, "entity_bytes": 0, "entity_count": 0}
+        with open(filepath, "wb") as f:
+            f.truncate(header_size + int(np.prod(shape)) * 2)
+        open(palette_path, "wb").close()
+        open(entities_path, "wb").close()
+    else:
+        print(f"续扫: 已完成 {state['done']}/{len(columns)} 个区块列")
+
+    # 检查点之后追加的内容属于未完成的区块列, 截掉
+    palette = [None]
+    with open(palette_path, "r+b") as f:
+        f.truncate(state["palette_bytes"])
+        palette.extend(json.loads(line) for line in f)
+    with open(entities_path, "r+b") as f:
+        f.truncate(state["entity_bytes"])
+    ids = {(e["name"], tuple(sorted(e["props"].items()))): i for i, e in enumerate(palette) if e}
+    palette_file = open(palette_path, "ab")
+    entities_file = open(entities_path, "ab")
+    out = np.memmap(filepath, dtype=np.uint16, mode="r+", offset=header_size, shape=shape)
+    raw = _unwrap_level(level)
+    started = time.time()
+    scanned = 0
+    for n in range(state["done"], len(columns)):
+        cx, cz = columns[n]
+        ax, bx = max(min_x, cx * 16), min(max_x, cx * 16 + 15)
+        az, bz = max(min_z, cz * 16), min(max_z, cz * 16 + 15)
+        view = RegionView(raw, ax, min_y, az, bx, max_y, bz, dim, ver)
+        air = view.lookup({"air"})
+        remap = np.zeros(len(view.palette), dtype=np.uint16)
+        for idx, block in enumerate(view.blocks):
+            if air[idx]:
+                continue
+            props = {}
+            if hasattr(block, 'properties'):
+                for k, v in block.properties.items():
+                    props[k] = str(v)
+            key = (view.palette[idx], tuple(sorted(props.items())))
+            if key not in ids:
+                if len(palette) > 0xFFFF:
+                    raise ValueError("调色板超过 65535 种方块状态")
+                ids[key] = len(palette)
+                entry = {"name": view.palette[idx], "props": props}
+                palette.append(entry)
+                palette_file.write(json.dumps(entry, separators=(",", ":")).encode() + b"\n")
+            remap[idx] = ids[key]
+        column = remap[view.indices]
+        out[ax - min_x:bx - min_x + 1, :, az - min_z:bz - min_z + 1] = column
+        state["block_count"] += int(np.count_nonzero(column))
+        for idx, snbt in _scan_block_entities(raw, ax, min_y, az, bx, max_y, bz, dim, ver).items():
+            # 列内索引 -> 整个区域的位置索引
+            rx, ry, rz = np.unravel_index(idx, column.shape)
+            gidx = ((int(rx) + ax - min_x) * shape[1] + int(ry)) * shape[2] + int(rz) + az - min_z
+            entities_file.write(json.dumps([gidx, snbt]).encode() + b"\n")
+            state["entity_count"] += 1
+        state["done"] = n + 1
+        scanned += column.size
+        del view, column
+        if hasattr(raw, "unload_unchanged"):
+            raw.unload_unchanged()
+
+        # 检查点: 先落盘数据, 再原子替换进度文件
+        out.flush()
+        palette_file.flush()
+        entities_file.flush()
+        state["palette_bytes"] = palette_file.tell()
+        state["entity_bytes"] = entities_file.tell()
+        with open(progress_path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(progress_path + ".tmp", progress_path)
+        if state["done"] % 64 == 0 or state["done"] == len(columns):
+            elapsed = max(time.time() - started, 1e-6)
+            print(f"  扫描进度: {state['done']}/{len(columns)} 区块列 "
+                  f"({state['done'] * 100 // len(columns)}%), {scanned / elapsed:,.0f} 方块/秒")
+    out.flush()
+    del out
+    palette_file.close()
+    entities_file.close()
+
+    # 调色板、meta 与方块实体追加在数据之后, 最后回填文件头
+    data_length = int(np.prod(shape)) * 2
+    palette_bytes = json.dumps(palette, separators=(",", ":")).encode()
+    meta_bytes = json.dumps({"scanned_from": region[:3], "scanned_to": region[3:]},
+                            separators=(",", ":")).encode()
+    entities = state["entity_count"]
+    palette_offset = header_size + data_length
+    with open(filepath, "r+b") as f:
+        f.seek(palette_offset)
+        f.write(palette_bytes)
+        f.write(meta_bytes)
+        if entities:
+            # 逐行拼出 {位置索引: snbt} JSON, 不把全部方块实体读入内存
+            f.write(b"{")
+            with open(entities_path, "rb") as src:
+                for i, line in enumerate(src):
+                    gidx, snbt = json.loads(line)
+                    f.write(b"," if i else b"")
+                    f.write(f'"{gidx}":{json.dumps(snbt)}'.encode())
+            f.write(b"}")
+        f.truncate()
+        f.seek(0)
+        f.write(struct.pack(_MCBT_HEADER, _MCBT_MAGIC, _MCBT_VERSION,
+                            _MCBT_FLAG_ENTITIES if entities else 0, *shape,
+                            state["block_count"], 0, 2,
+                            header_size, data_length, palette_offset, len(palette_bytes),
+                            palette_offset + len(palette_bytes), len(meta_bytes)))
+    for path in (progress_path, palette_path, entities_path):
+        os.remove(path)
+    print(f"扫描完成: {shape[0]}x{shape[1]}x{shape[2]}, {state['block_count']} 个方块 -> {filepath}")
+    return filepath
+
+# ---------- 二进制模板格式 (.mcbt) ----------
+# 文件头 (小端, 固定长度) + 稠密调色板索引数组 (x, y, z 顺序, 0 表示空位)
+# + 调色板 JSON + meta JSON (+ flags 第 0 位为 1 时, 文件末尾为方块实体旁表 JSON)。
+# 未压缩时索引数组可直接 np.memmap。
+_MCBT_MAGIC = b"MCBT"
+_MCBT_VERSION = 1
+_MCBT_HEADER = "<4sHH3iIBB2x6Q"
+_MCBT_COMPRESSION = {None: 0, "none": 0, "zlib": 1, "zstd": 2}
+_MCBT_FLAG_ENTITIES = 1
+
+def _template_to_palette(template):
+    """把 JSON 列表模板转为调色板模板 {size, block_count, palette, indices, block_entities, meta}
+    palette[0] 固定为 None (空位), 其余为 {"name", "props"}"""
+    import numpy as np
+
+    if "indices" in template:
+        return template
+    sx, sy, sz = template["size"]
+    palette = [None]
+    ids = {}
+    entities = {}
+    indices = np.zeros((sx, sy, sz), dtype=np.uint32)
+    for entry in template["blocks"]:
+        props = entry.get("props") or {}
+        key = (entry["name"], tuple(sorted(props.items())))
+        idx = ids.get(key)
+        if idx is None:
+            idx = ids[key] = len(palette)
+            palette.append({"name": entry["name"], "props": dict(props)})
+        rx, ry, rz = entry["pos"]
+        indices[rx, ry, rz] = idx
+        if entry.get("nbt"):
+            entities[(rx * sy + ry) * sz + rz] = entry["nbt"]
+    return {
+        "size": [sx, sy, sz],
+        "block_count": int(np.count_nonzero(indices)),
+        "palette": palette,
+        "indices": indices.astype(_palette_dtype(len(palette))),
+        "block_entities": entities,
+        "meta": dict(template.get("meta", {})),
+    }
+
+def _palette_dtype(n):
+    import numpy as np
+    if n <= 1 << 8:
+        return np.uint8
+    if n <= 1 << 16:
+        return np.uint16
+    return np.uint32
+
+def _iter_template_blocks(template):
+    """逐个产出模板方块 {"pos", "name", "props"?, "nbt"?}, 两种模板格式通用"""
+    import numpy as np
+
+    if "indices" not in template:
+        yield from template["blocks"]
+        return
+    palette = template["palette"]
+    indices = template["indices"]
+    entities = template.get("block_entities") or {}
+    _, sy, sz = indices.shape
+    for x0 in range(0, indices.shape[0], 16):
+        slab = np.asarray(indices[x0:x0 + 16])
+        for rx, ry, rz in np.argwhere(slab).tolist():
+            entry = palette[slab[rx, ry, rz]]
+            block = {"pos": [x0 + rx, ry, rz], "name": entry["name"]}
+            if entry.get("props"):
+                block["props"] = dict(entry["props"])
+            snbt = entities.get(((x0 + rx) * sy + ry) * sz + rz)
+            if snbt is not None:
+                block["nbt"] = snbt
+            yield block
+
+def _template_to_json(template):
+    """调色板模板 -> 原 JSON 列表格式"""
+    if "indices" not in template:
+        return template
+    blocks = list(_iter_template_blocks(template))
+    return {
+        "size": list(template["size"]),
+        "block_count": len(blocks),
+        "blocks": blocks,
+        "meta": template.get("meta", {}),
+    }
+
+def _save_mcbt(template, filepath, compression="zlib"):
+    import struct
+    import zlib
+    import numpy as np
+
+    template = _template_to_palette(template)
+    indices = np.ascontiguousarray(template["indices"],
+                                   dtype=_palette_dtype(len(template["palette"])))
+    data = indices.tobytes()
+    if compression == "zstd":
+        try:
+            import zstandard
+            data = zstandard.ZstdCompressor(level=10).compress(data)
+        except ImportError:
+            print("未安装 zstandard, 改用 zlib 压缩 (pip3 install zstandard)")
+            compression = "zlib"
+    if compression == "zlib":
+        data = zlib.compress(data, 6)
+    palette = json.dumps(template["palette"], separators=(",", ":")).encode()
+    meta = json.dumps(template.get("meta", {}), separators=(",", ":")).encode()
+    entities = template.get("block_entities")
+    entities = json.dumps(entities, separators=(",", ":")).encode() if entities else b""
+    header_size = struct.calcsize(_MCBT_HEADER)
+    data_offset = header_size
+    palette_offset = data_offset + len(data)
+    meta_offset = palette_offset + len(palette)
+    sx, sy, sz = template["size"]
+    flags = _MCBT_FLAG_ENTITIES if entities else 0
+    header = struct.pack(_MCBT_HEADER, _MCBT_MAGIC, _MCBT_VERSION, flags, sx, sy, sz,
+                         template["block_count"], _MCBT_COMPRESSION[compression], indices.itemsize,
+                         data_offset, len(data), palette_offset, len(palette), meta_offset, len(meta))
+    with open(filepath, "wb") as f:
+        f.write(header)
+        f.write(data)
+        f.write(palette)
+        f.write(meta)
+        f.write(entities)
+
+def _read_mcbt_header(f):
+    import struct
+
+    raw = f.read(struct.calcsize(_MCBT_HEADER))
+    if len(raw) < struct.calcsize(_MCBT_HEADER) or raw[:4] != _MCBT_MAGIC:
+        raise ValueError("不是 .mcbt 模板文件")
+    fields = struct.unpack(_MCBT_HEADER, raw)
+    if fields[1] > _MCBT_VERSION:
+        raise ValueError(f"不支持的 .mcbt 版本: {fields[1]}")
+    keys = ("magic", "version", "flags", "sx", "sy", "sz", "block_count", "compression", "itemsize",
+            "data_offset", "data_length", "palette_offset", "palette_length", "meta_offset", "meta_length")
+    return dict(zip(keys, fields))
+
+def _load_mcbt(filepath):
+    """读取 .mcbt: 未压缩时索引数组为只读 memmap, 按需分页读入"""
+    import zlib
+    import numpy as np
+
+    with open(filepath, "rb") as f:
+        h = _read_mcbt_header(f)
+        f.seek(h["palette_offset"])
+        palette = json.loads(f.read(h["palette_length"]))
+        f.seek(h["meta_offset"])
+        meta = json.loads(f.read(h["meta_length"])) if h["meta_length"] else {}
+        entities = {}
+        if h["flags"] & _MCBT_FLAG_ENTITIES:
+            entities = {int(k): v for k, v in json.loads(f.read()).items()}
+        dtype = {1: np.uint8, 2: np.uint16, 4: np.uint32}[h["itemsize"]]
+        shape = (h["sx"], h["sy"], h["sz"])
+        if h["compression"] == 0:
+            indices = np.memmap(filepath, dtype=dtype, mode="r", offset=h["data_offset"], shape=shape)
+        else:
+            f.seek(h["data_offset"])
+            data = f.read(h["data_length"])
+            if h["compression"] == 1:
+                data = zlib.decompress(data)
+            else:
+                import zstandard
+                data = zstandard.ZstdDecompressor().decompress(data)
+            indices = np.frombuffer(data, dtype=dtype).reshape(shape)
+    return {
+        "size": list(shape),
+        "block_count": h["block_count"],
+        "palette": palette,
+        "indices": indices,
+        "block_entities": entities,
+        "meta": meta,
+    }
+
+# ---------- 原版结构文件 (.nbt) ----------
+# 结构方块使用的 gzip NBT: size / palette [{Name, Properties}] / blocks [{state, pos}]
+_STRUCTURE_DATA_VERSION = 3953
+
+def _load_structure_nbt(filepath):
+    """读取原版 .nbt 结构为调色板模板 (调色板索引 +1, 0 留给空位)"""
+    import nbtlib
+    import numpy as np
+
+    nbt = nbtlib.load(filepath)
+    sx, sy, sz = (int(v) for v in nbt["size"])
+    palette = [None]
+    # 多调色板 (如沉船) 只取第一套
+    states = nbt["palettes"][0] if "palettes" in nbt else nbt["palette"]
+    for state in states:
+        name = str(state["Name"])
+        if name.startswith("minecraft:"):
+            name = name[len("minecraft:"):]
+        props = {str(k): str(v) for k, v in state.get("Properties", {}).items()}
+        palette.append({"name": name, "props": props})
+
+    blocks = nbt["blocks"]
+    n = len(blocks)
+    state_ids = np.fromiter((int(b["state"]) for b in blocks), dtype=np.int64, count=n)
+    pos = np.fromiter((int(v) for b in blocks for v in b["pos"]), dtype=np.int64, count=n * 3).reshape(n, 3)
+    indices = np.zeros((sx, sy, sz), dtype=_palette_dtype(len(palette)))
+    indices[pos[:, 0], pos[:, 1], pos[:, 2]] = state_ids + 1
+    entities = {}
+    for i, b in enumerate(blocks):
+        if "nbt" in b:
+            rx, ry, rz = pos[i].tolist()
+            entities[(rx * sy + ry) * sz + rz] = b["nbt"].snbt()
+    return {
+        "size": [sx, sy, sz],
+        "block_count": int(np.count_nonzero(indices)),
+        "palette": palette,
+        "indices": indices,
+        "block_entities": entities,
+        "meta": {"data_version": int(nbt.get("DataVersion", _STRUCTURE_DATA_VERSION))},
+    }
+
+def _save_structure_nbt(template, filepath):
+    """写出原版 .nbt 结构 (gzip), 空位不写入, 粘贴时保留原方块"""
+    import nbtlib
+    from nbtlib.tag import Compound, Int, List, String
+    import numpy as np
+
+    template = _template_to_palette(template)
+    palette = template["palette"]
+    used = [0] * len(palette)
+    nbt_palette = []
+    for idx, entry in enumerate(palette):
+        if entry is None:
+            continue
+        used[idx] = len(nbt_palette)
+        namespace, _, base_name = entry["name"].rpartition(":")
+        state = Compound({"Name": String(f"{namespace or 'minecraft'}:{_fix_block_name(base_name)}")})
+        if entry.get("props"):
+            state["Properties"] = Compound({k: String(str(v)) for k, v in entry["props"].items()})
+        nbt_palette.append(state)
+
+    _, sy, sz = template["size"]
+    entities = template.get("block_entities") or {}
+    blocks = List[Compound]()
+    for x0 in range(0, template["size"][0], 16):
+        slab = np.asarray(template["indices"][x0:x0 + 16])
+        for (rx, ry, rz), idx in zip(np.argwhere(slab).tolist(), slab[slab != 0].tolist()):
+            block = Compound({
+                "state": Int(used[idx]),
+                "pos": List[Int]([Int(x0 + rx), Int(ry), Int(rz)]),
+            })
+            snbt = entities.get(((x0 + rx) * sy + ry) * sz + rz)
+            if snbt is not None:
+                block["nbt"] = nbtlib.parse_nbt(snbt)
+            blocks.append(block)
+
+    data_version = template.get("meta", {}).get("data_version", _STRUCTURE_DATA_VERSION)
+    root = nbtlib.File({
+        "DataVersion": Int(data_version),
+        "size": List[Int]([Int(v) for v in template["size"]]),
+        "palette": List[Compound](nbt_palette),
+        "blocks": blocks,
+        "entities": List[Compound](),
+    }, gzipped=True)
+    root.save(filepath)
+
+# ---------- Sponge .schem / Litematica .litematic ----------
+
+def _parse_block_state(state):
+    """"minecraft:oak_stairs[facing=east,half=bottom]" -> ("oak_stairs", {"facing": "east", ...})"""
+    name, _, rest = state.partition("[")
+    if name.startswith("minecraft:"):
+        name = name[len("minecraft:"):]
+    props = {}
+    for pair in rest.rstrip("]").split(","):
+        if "=" in pair:
+            k, v = pair.split("=", 1)
+            props[k.strip()] = v.strip()
+    return name, props
+
+def _decode_varints(data):
+    """解码 LEB128 varint 字节流 (Sponge BlockData), 整段向量化"""
+    import numpy as np
+
+    b = np.asarray(data).view(np.uint8).reshape(-1)
+    ends = np.flatnonzero(b < 0x80)
+    if not len(ends):
+        return np.zeros(0, dtype=np.int64)
+    b = b[:ends[-1] + 1]
+    starts = np.r_[0, ends[:-1] + 1]
+    group = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shift = (np.arange(len(b)) - starts[group]) * 7
+    # 各字节的 7 位互不重叠, 按组求和即按位或
+    return np.add.reduceat((b & 0x7F).astype(np.int64) << shift, starts)
+
+def _unpack_spanning(longs, bits, count):
+    """解码 Litematica 跨 long 的紧密位打包数组, 返回 count 个值"""
+    import numpy as np
+
+    words = np.r_[np.asarray(longs).view(np.uint64).reshape(-1), np.zeros(1, dtype=np.uint64)]
+    bit = np.arange(count, dtype=np.uint64) * np.uint64(bits)
+    start = (bit >> np.uint64(6)).astype(np.int64)
+    offset = bit & np.uint64(63)
+    values = words[start] >> offset
+    spans = offset + np.uint64(bits) > 64
+    hi = words[start[spans] + 1] << ((np.uint64(64) - offset[spans]) & np.uint64(63))
+    values[spans] |= hi
+    return (values & np.uint64((1 << bits) - 1)).astype(np.int64)
+
+def _load_schem(filepath):
+    """读取 Sponge .schem (v1/v2/v3) 为调色板模板, 索引顺序 x + z*W + y*W*L"""
+    import nbtlib
+    import numpy as np
+
+    nbt = nbtlib.load(filepath)
+    root = nbt["Schematic"] if "Schematic" in nbt else nbt
+    sx, sy, sz = int(root["Width"]), int(root["Height"]), int(root["Length"])
+    blocks = root["Blocks"] if "Blocks" in root else root
+    raw_palette = blocks["Palette"]
+    data = blocks["Data"] if "Data" in blocks else blocks["BlockData"]
+
+    palette = [None] * (max(int(v) for v in raw_palette.values()) + 2)
+    for state, idx in raw_palette.items():
+        name, props = _parse_block_state(str(state))
+        palette[int(idx) + 1] = {"name": name, "props": props}
+    for i in range(1, len(palette)):
+        if palette[i] is None:
+            palette[i] = {"name": "air", "props": {}}
+
+    values = _decode_varints(data)[:sx * sy * sz] + 1
+    indices = values.reshape(sy, sz, sx).transpose(2, 0, 1)
+    indices = np.ascontiguousarray(indices, dtype=_palette_dtype(len(palette)))
+    offset = [int(v) for v in root.get("Offset", [0, 0, 0])]
+
+    # v3: Blocks.BlockEntities [{Pos, Id, Data}]; v2: BlockEntities; v1: TileEntities (字段平铺)
+    entities = {}
+    raw_entities = blocks.get("BlockEntities", root.get("BlockEntities", root.get("TileEntities", [])))
+    for be in raw_entities:
+        rx, ry, rz = (int(v) for v in be["Pos"])
+        if "Data" in be:
+            compound = nbtlib.Compound(be["Data"])
+        else:
+            compound = nbtlib.Compound({k: v for k, v in be.items() if k not in ("Pos", "Id")})
+        compound["id"] = nbtlib.String(str(be["Id"]))
+        entities[(rx * sy + ry) * sz + rz] = compound.snbt()
+    return {
+        "size": [sx, sy, sz],
+        "block_count": int(np.count_nonzero(indices)),
+        "palette": palette,
+        "indices": indices,
+        "block_entities": entities,
+        "meta": {"data_version": int(root.get("DataVersion", _STRUCTURE_DATA_VERSION)), "offset": offset},
+    }
+
+def _load_litematic(filepath):
+    """读取 .litematic 为调色板模板, 多个子区域按各自位置合并到同一包围盒
+    子区域中的空气视为空位 (粘贴时保留原方块)"""
+    import nbtlib
+    import numpy as np
+
+    nbt = nbtlib.load(filepath)
+    palette = [None]
+    ids = {}
+    regions = []
+    for region in nbt["Regions"].values():
+        pos = [int(region["Position"][k]) for k in "xyz"]
+        size = [int(region["Size"][k]) for k in "xyz"]
+        # 负尺寸表示区域向负方向延伸
+        lo = [p + s + 1 if s < 0 else p for p, s in zip(pos, size)]
+        size = [abs(s) for s in size]
+        lut = []
+        for state in region["BlockStatePalette"]:
+            name = str(state["Name"])
+            if name.startswith("minecraft:"):
+                name = name[len("minecraft:"):]
+            props = {str(k): str(v) for k, v in state.get("Properties", {}).items()}
+            if name == "air":
+                lut.append(0)
+                continue
+            key = (name, tuple(sorted(props.items())))
+            if key not in ids:
+                ids[key] = len(palette)
+                palette.append({"name": name, "props": props})
+            lut.append(ids[key])
+        bits = max(2, (len(lut) - 1).bit_length())
+        count = size[0] * size[1] * size[2]
+        values = _unpack_spanning(region["BlockStates"], bits, count)
+        # 索引顺序 (y * Z + z) * X + x
+        local = np.asarray(lut, dtype=np.int64)[values].reshape(size[1], size[2], size[0]).transpose(2, 0, 1)
+        # TileEntities 的 x/y/z 相对子区域最小角; 无 id 的条目无法还原, 跳过
+        tiles = [(int(be["x"]), int(be["y"]), int(be["z"]),
+                  nbtlib.Compound({k: v for k, v in be.items() if k not in ("x", "y", "z")}))
+                 for be in region.get("TileEntities", []) if "id" in be]
+        regions.append((lo, local, tiles))
+
+    origin = [min(lo[i] for lo, _, _ in regions) for i in range(3)]
+    extent = [max(lo[i] + local.shape[i] for lo, local, _ in regions) - origin[i] for i in range(3)]
+    indices = np.zeros(extent, dtype=_palette_dtype(len(palette)))
+    entities = {}
+    for lo, local, tiles in regions:
+        ox, oy, oz = (lo[i] - origin[i] for i in range(3))
+        dst = indices[ox:ox + local.shape[0], oy:oy + local.shape[1], oz:oz + local.shape[2]]
+        np.copyto(dst, local, where=local != 0, casting="unsafe")
+        for tx, ty, tz, compound in tiles:
+            entities[((ox + tx) * extent[1] + oy + ty) * extent[2] + oz + tz] = compound.snbt()
+    meta = {"data_version": int(nbt.get("MinecraftDataVersion", _STRUCTURE_DATA_VERSION))}
+    if "Metadata" in nbt and "Name" in nbt["Metadata"]:
+        meta["name"] = str(nbt["Metadata"]["Name"])
+    return {
+        "size": extent,
+        "block_count": int(np.count_nonzero(indices)),
+        "palette": palette,
+        "indices": indices,
+        "block_entities": entities,
+        "meta": meta,
+    }
+
+_TEMPLATE_EXTENSIONS = (".mcbt", ".nbt", ".schem", ".litematic", ".json")
+
+def _template_file(filepath):
+    """模板名/路径 -> 实际文件 (在 templates 目录中依次尝试各模板扩展名)"""
+    if os.path.isabs(filepath) or os.path.exists(filepath):
+        return filepath
+    candidate = os.path.join(TEMPLATES_DIR, filepath)
+    for path in (candidate, *(candidate + ext for ext in _TEMPLATE_EXTENSIONS)):
+        if os.path.exists(path):
+            return path
+    return filepath
+
+def save_template(template, filepath=None, name=None, compression="zlib", tags=None):
+    """保存模板
+    filepath: 完整路径, 或 name: 自动保存到 templates 目录 (默认 .mcbt 二进制格式)
+    格式按扩展名: .mcbt (调色板 + 索引数组) / .nbt (原版结构文件) / .json (兼容旧格式)
+    .mcbt 的索引数组覆盖整个包围盒, 每格按字节对齐存一个 uint8/16/32 (不做位打包):
+    compression: "zlib" (默认) / "zstd" 压掉空位和重复, 文件小, 但加载时整块解压进内存;
+    None 不压缩, 文件大小为 长*宽*高*索引字节数, 加载时 memmap 按需读取, 适合超大模板
+    tags: 标签列表, 写入 meta 并进入模板索引"""
+    if tags is not None:
+        template = dict(template, meta=dict(template.get("meta", {}), tags=list(tags)))
+    if filepath is None:
+        if name is None:
+            name = f"template_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        os.makedirs(TEMPLATES_DIR, exist_ok=True)
+        filepath = os.path.join(TEMPLATES_DIR, f"{name}.mcbt")
+    if filepath.endswith(".json"):
+        with open(filepath, "w") as f:
+            json.dump(_template_to_json(template), f, indent=2)
+    elif filepath.endswith(".nbt"):
+        _save_structure_nbt(template, filepath)
+    else:
+        _save_mcbt(template, filepath, compression)
     print(f"模板已保存: {filepath} ({template['block_count']} 个方块)")
+    # 同目录的索引存在时顺带更新该条目
+    directory = os.path.dirname(os.path.abspath(filepath))
+    if os.path.exists(os.path.join(directory, _CATALOG_FILE)):
+        conn = _catalog_connect(directory)
+        with conn:
+            _catalog_index(conn, os.path.join(directory, os.path.basename(filepath)))
+        conn.close()
     return filepath
 
 def load_template(filepath):
-    """从 JSON 文件加载模板"""
-    if not os.path.isabs(filepath):
-        # 尝试从 templates 目录加载
-        candidate = os.path.join(TEMPLATES_DIR, filepath)
-        if os.path.exists(candidate):
-            filepath = candidate
-        elif os.path.exists(candidate + ".json"):
-            filepath = candidate + ".json"
-    with open(filepath, "r") as f:
-        template = json.load(f)
+    """加载模板 (支持 templates 目录中的模板名)
+    .mcbt / .nbt / .schem / .litematic 返回调色板模板 (.mcbt 索引数组惰性读取),
+    .json 返回原列表格式"""
+    filepath = _template_file(filepath)
+    template = _read_template(filepath)
     print(f"模板已加载: {filepath} (大小 {template['size']}, {template['block_count']} 个方块)")
     return template
 
+def _read_template(filepath):
+    """按扩展名读取模板文件 (不输出)"""
+    if filepath.endswith(".json"):
+        with open(filepath, "r") as f:
+            template = json.load(f)
+    elif filepath.endswith(".nbt"):
+        template = _load_structure_nbt(filepath)
+    elif filepath.endswith(".schem"):
+        template = _load_schem(filepath)
+    elif filepath.endswith(".litematic"):
+        template = _load_litematic(filepath)
+    else:
+        template = _load_mcbt(filepath)
+    return template
+
 def _rotate_pos(rx, ry, rz, sx, sy, sz, angle):
     """旋转相对坐标 (围绕 y 轴)"""
     if angle == 0:
@@ -1184,85 +3748,389 @@ def _rotate_axis(axis, angle):
             return "x"
     return axis
 
-def paste_structure(level, template, x, y, z, dim, ver, rotate=0, mirror=False):
-    """在指定位置粘贴模板
-    rotate: 0/90/180/270 度
-    mirror: 是否沿 x 轴镜像"""
+_DIRECTIONS = ("north", "east", "south", "west")
+_MIRROR_SIDES = {"left": "right", "right": "left"}
+_RAIL_SHAPES = {frozenset(s.split("_")): s for s in
+                ("north_south", "east_west", "south_east", "south_west", "north_west", "north_east")}
+
+def _transform_direction(direction, rotate, mirror):
+    """水平方向先沿 x 轴镜像 (东西互换) 再旋转; 非水平方向原样返回"""
+    if direction not in _DIRECTIONS:
+        return direction
+    if mirror and direction in ("east", "west"):
+        direction = "west" if direction == "east" else "east"
+    return _rotate_facing(direction, rotate)
+
+def _transform_props(props, rotate, mirror):
+    """对单个方块状态的属性做镜像 + 旋转
+    覆盖 facing / axis / 四向连接 (栅栏、墙、玻璃板、红石线等) / rotation (告示牌、旗帜、头颅)
+    / 楼梯与铁轨 shape / 门 hinge / 箱子 type"""
+    out = {}
+    for k, v in (props or {}).items():
+        if k in _DIRECTIONS:
+            k = _transform_direction(k, rotate, mirror)
+        elif k == "facing":
+            v = _transform_direction(v, rotate, mirror)
+        elif k == "axis":
+            v = _rotate_axis(v, rotate)
+        elif k == "rotation" and str(v).isdigit():
+            # 16 向: 0=南 4=西 8=北 12=东, 顺时针递增
+            r = int(v)
+            if mirror:
+                r = (16 - r) % 16
+            v = str((r + rotate // 90 * 4) % 16)
+        elif k == "shape" and v.startswith("ascending_"):
+            v = "ascending_" + _transform_direction(v[len("ascending_"):], rotate, mirror)
+        elif k == "shape" and frozenset(v.split("_")) in _RAIL_SHAPES:
+            v = _RAIL_SHAPES[frozenset(_transform_direction(d, rotate, mirror) for d in v.split("_"))]
+        elif mirror and k == "shape" and v.split("_")[-1] in _MIRROR_SIDES:
+            head, side = v.rsplit("_", 1)
+            v = f"{head}_{_MIRROR_SIDES[side]}"
+        elif mirror and k in ("hinge", "type") and v in _MIRROR_SIDES:
+            v = _MIRROR_SIDES[v]
+        out[k] = v
+    return out
+
+def _paste_palette(writer, template, x, y, z, dim, ver, rotate, mirror):
+    """调色板模板粘贴: 每个调色板状态只变换/构造一次方块,
+    坐标按 16 宽切片整体变换后用 set_many 批量写入; 带方块实体的位置不进批量写入, 随后连同实体各写一次"""
+    import numpy as np
+
     sx, sy, sz = template["size"]
-    count = 0
-    for entry in template["blocks"]:
-        rx, ry, rz = entry["pos"]
-        name = entry["name"]
-        props = dict(entry.get("props", {}))
+    blocks = [None]
+    for entry in template["palette"][1:]:
+        if entry is None:
+            blocks.append(None)
+            continue
+        props = _transform_props(entry.get("props"), rotate, mirror)
+        blocks.append(_BLOCK_CACHE.get(entry["name"], props or None, ver))
 
-        # 镜像
+    indices = template["indices"]
+    entities = template.get("block_entities") or {}
+    entity_idx = np.array(sorted(int(k) for k in entities), dtype=np.int64)
+    count = 0
+    for x0 in range(0, sx, 16):
+        slab = np.asarray(indices[x0:x0 + 16])
+        rx, ry, rz = np.nonzero(slab)
+        rx = rx + x0
+        if len(entity_idx) and len(rx):
+            keep = ~np.isin((rx * sy + ry) * sz + rz, entity_idx)
+            rx, ry, rz = rx[keep], ry[keep], rz[keep]
+        if not len(rx):
+            continue
+        values = slab[rx - x0, ry, rz].astype(np.int64)
         if mirror:
             rx = sx - 1 - rx
-            if "facing" in props:
-                f = props["facing"]
-                if f == "east":
-                    props["facing"] = "west"
-                elif f == "west":
-                    props["facing"] = "east"
-
-        # 旋转
         rx, ry, rz = _rotate_pos(rx, ry, rz, sx, sy, sz, rotate)
-        if "facing" in props:
-            props["facing"] = _rotate_facing(props["facing"], rotate)
-        if "axis" in props:
-            props["axis"] = _rotate_axis(props["axis"], rotate)
-
-        place_block(level, x + rx, y + ry, z + rz, dim, ver, name, props if props else None)
-        count += 1
+        order = np.argsort(values, kind="stable")
+        values = values[order]
+        starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+        ends = np.r_[starts[1:], len(values)]
+        for a, b in zip(starts.tolist(), ends.tolist()):
+            block = blocks[values[a]]
+            if block is None:
+                continue
+            sel = order[a:b]
+            writer.set_many(x + rx[sel], y + ry[sel], z + rz[sel], dim, ver, block)
+            count += b - a
+
+    # 方块实体随所在区块的缓冲一起 flush, 按区块批量写入; 位置记入会话供 fix_connections 使用
+    placed = []
+    for idx, snbt in entities.items():
+        rx, ry, rz = (int(v) for v in np.unravel_index(int(idx), (sx, sy, sz)))
+        block = blocks[int(indices[rx, ry, rz])]
+        if block is None:
+            continue
+        if mirror:
+            rx = sx - 1 - rx
+        rx, ry, rz = _rotate_pos(rx, ry, rz, sx, sy, sz, rotate)
+        wx, wy, wz = x + rx, y + ry, z + rz
+        writer.set_version_block(wx, wy, wz, dim, ver, block, _block_entity_from_snbt(snbt, wx, wy, wz))
+        placed.append((wx, wy, wz))
+    if placed:
+        xs, ys, zs = (np.array(a, dtype=np.int64) for a in zip(*placed))
+        _session(writer).record_many(dim, xs, ys, zs)
+        count += len(placed)
+    return count
 
+@_batched
+def paste_structure(level, template, x, y, z, dim, ver, rotate=0, mirror=False):
+    """在指定位置粘贴模板
+    rotate: 0/90/180/270 度
+    mirror: 是否沿 x 轴镜像"""
+    if isinstance(level, BuildPlan):
+        level.paste(template, x, y, z, dim, ver, rotate, mirror)
+        return template["block_count"]
+    # 列表格式先转为调色板, 旋转/镜像只按不同方块状态计算
+    count = _paste_palette(level, _template_to_palette(template), x, y, z, dim, ver, rotate, mirror)
     print(f"粘贴完成: ({x},{y},{z}), {count} 个方块, 旋转 {rotate}°{' 镜像' if mirror else ''}")
     return count
 
+# ---------- 模板目录索引 (SQLite) ----------
+# templates 目录下的 .catalog.sqlite: 每个模板一行元数据 + 材料清单表,
+# 按 (mtime, 文件大小) 增量更新, 列出/搜索不再打开模板文件
+_CATALOG_FILE = ".catalog.sqlite"
+
+def _catalog_connect(directory):
+    import sqlite3
+
+    conn = sqlite3.connect(os.path.join(directory, _CATALOG_FILE))
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS templates (
+            file TEXT PRIMARY KEY, name TEXT, format TEXT,
+            mtime_ns INTEGER, file_size INTEGER, checksum TEXT,
+            sx INTEGER, sy INTEGER, sz INTEGER, block_count INTEGER,
+            palette_size INTEGER, tags TEXT, meta TEXT
+        );
+        CREATE TABLE IF NOT EXISTS materials (
+            file TEXT, block TEXT, count INTEGER,
+            PRIMARY KEY (file, block)
+        );
+        CREATE INDEX IF NOT EXISTS materials_block ON materials (block);
+        CREATE TABLE IF NOT EXISTS failures (
+            file TEXT PRIMARY KEY, mtime_ns INTEGER, file_size INTEGER, error TEXT
+        );
+    """)
+    return conn
+
+def _file_checksum(filepath):
+    import hashlib
+
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _template_materials(template):
+    """材料清单 {方块名: 数量}, 调色板模板按切片 bincount"""
+    import numpy as np
+
+    counts = {}
+    if "indices" not in template:
+        for entry in template["blocks"]:
+            counts[entry["name"]] = counts.get(entry["name"], 0) + 1
+        return counts
+    palette = template["palette"]
+    total = np.zeros(len(palette), dtype=np.int64)
+    for x0 in range(0, template["size"][0], 16):
+        slab = np.asarray(template["indices"][x0:x0 + 16]).reshape(-1)
+        total += np.bincount(slab, minlength=len(palette))[:len(palette)]
+    for idx in np.flatnonzero(total[1:]) + 1:
+        name = palette[idx]["name"]
+        counts[name] = counts.get(name, 0) + int(total[idx])
+    return counts
+
+def _catalog_index(conn, filepath, st=None):
+    """(重新) 索引单个模板文件"""
+    if st is None:
+        st = os.stat(filepath)
+    template = _read_template(filepath)
+    materials = _template_materials(template)
+    meta = template.get("meta", {})
+    palette_size = len(template["palette"]) - 1 if "palette" in template else len(materials)
+    sx, sy, sz = template["size"]
+    conn.execute("DELETE FROM materials WHERE file = ?", (filepath,))
+    conn.execute("INSERT OR REPLACE INTO templates VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", (
+        filepath, os.path.splitext(os.path.basename(filepath))[0], os.path.splitext(filepath)[1][1:],
+        st.st_mtime_ns, st.st_size, _file_checksum(filepath),
+        sx, sy, sz, sum(materials.values()), palette_size,
+        json.dumps(meta.get("tags", [])), json.dumps(meta, default=str),
+    ))
+    conn.executemany("INSERT INTO materials VALUES (?,?,?)",
+                     [(filepath, name, count) for name, count in materials.items()])
+
+def update_catalog(directory=None):
+    """增量更新模板索引: 只重新读取新增或 mtime/大小变化的文件, 删除已消失的条目
+    返回重新索引的文件数"""
+    directory = os.path.abspath(directory or TEMPLATES_DIR)
+    if not os.path.isdir(directory):
+        return 0
+    conn = _catalog_connect(directory)
+    known = {row[0]: (row[1], row[2]) for row in
+             conn.execute("SELECT file, mtime_ns, file_size FROM templates")}
+    # 读取失败的文件按 mtime/大小缓存, 未变化时不再重复解析
+    failed = {row[0]: (row[1], row[2]) for row in
+              conn.execute("SELECT file, mtime_ns, file_size FROM failures")}
+    seen = set()
+    updated = 0
+    with conn:
+        for fname in sorted(os.listdir(directory)):
+            if not fname.endswith(_TEMPLATE_EXTENSIONS):
+                continue
+            fpath = os.path.join(directory, fname)
+            if os.path.exists(fpath + ".progress"):
+                continue  # scan_to_file 尚未完成, 文件头还未回填
+            seen.add(fpath)
+            st = os.stat(fpath)
+            if (st.st_mtime_ns, st.st_size) in (known.get(fpath), failed.get(fpath)):
+                continue
+            try:
+                _catalog_index(conn, fpath, st)
+                conn.execute("DELETE FROM failures WHERE file = ?", (fpath,))
+                updated += 1
+            except Exception as e:
+                print(f"  索引失败: {fname} ({e})")
+                conn.execute("INSERT OR REPLACE INTO failures VALUES (?,?,?,?)",
+                             (fpath, st.st_mtime_ns, st.st_size, str(e)))
+        for fpath in (set(known) | set(failed)) - seen:
+            conn.execute("DELETE FROM templates WHERE file = ?", (fpath,))
+            conn.execute("DELETE FROM materials WHERE file = ?", (fpath,))
+            conn.execute("DELETE FROM failures WHERE file = ?", (fpath,))
+    conn.close()
+    return updated
+
+def _catalog_rows(conn, where="", params=()):
+    # 材料清单一次查询按文件分组, 避免每个模板一次查询
+    materials_by_file = {}
+    for fpath, block, count in conn.execute(
+            f"SELECT file, block, count FROM materials WHERE file IN (SELECT file FROM templates {where}) "
+            "ORDER BY file, count DESC", params):
+        materials_by_file.setdefault(fpath, {})[block] = count
+    templates = []
+    for row in conn.execute(
+            "SELECT file, name, format, sx, sy, sz, block_count, palette_size, tags, checksum "
+            f"FROM templates {where} ORDER BY name", params):
+        materials = materials_by_file.get(row[0], {})
+        templates.append({
+            "name": row[1],
+            "file": row[0],
+            "format": row[2],
+            "size": [row[3], row[4], row[5]],
+            "block_count": row[6],
+            "palette_size": row[7],
+            "tags": json.loads(row[8]),
+            "checksum": row[9],
+            "materials": materials,
+        })
+    return templates
+
+def search_templates(query=None, tags=None, material=None, min_blocks=None, max_blocks=None,
+                     directory=None):
+    """按索引搜索模板 (先增量更新索引)
+    query: 名称包含的子串; tags: 须全部包含的标签; material: 须使用的方块名
+    min_blocks / max_blocks: 方块数范围"""
+    if directory is None:
+        directory = TEMPLATES_DIR
+    update_catalog(directory)
+    if not os.path.isdir(directory):
+        return []
+    clauses, params = [], []
+    if query:
+        clauses.append("name LIKE ?")
+        params.append(f"%{query}%")
+    if material:
+        clauses.append("file IN (SELECT file FROM materials WHERE block = ?)")
+        params.append(material)
+    if min_blocks is not None:
+        clauses.append("block_count >= ?")
+        params.append(min_blocks)
+    if max_blocks is not None:
+        clauses.append("block_count <= ?")
+        params.append(max_blocks)
+    conn = _catalog_connect(directory)
+    templates = _catalog_rows(conn, ("WHERE " + " AND ".join(clauses)) if clauses else "", params)
+    conn.close()
+    if tags:
+        templates = [t for t in templates if set(tags) <= set(t["tags"])]
+    print(f"找到 {len(templates)} 个匹配模板")
+    return templates
+
 def list_templates(directory=None):
-    """列出模板目录中所有可用模板"""
+    """列出模板目录中所有可用模板 (读取 SQLite 索引, 仅重新读取有变化的文件)"""
     if directory is None:
         directory = TEMPLATES_DIR
     if not os.path.isdir(directory):
         print(f"模板目录不存在: {directory}")
         return []
-    templates = []
-    for fname in sorted(os.listdir(directory)):
-        if not fname.endswith(".json"):
-            continue
-        fpath = os.path.join(directory, fname)
-        try:
-            with open(fpath, "r") as f:
-                data = json.load(f)
-            templates.append({
-                "name": fname[:-5],
-                "file": fpath,
-                "size": data.get("size", [0, 0, 0]),
-                "block_count": data.get("block_count", 0),
-            })
-        except (json.JSONDecodeError, KeyError):
-            continue
+    update_catalog(directory)
+    conn = _catalog_connect(directory)
+    templates = _catalog_rows(conn)
+    conn.close()
     print(f"找到 {len(templates)} 个模板")
     for t in templates:
         print(f"  {t['name']}: {t['size'][0]}x{t['size'][1]}x{t['size'][2]}, {t['block_count']} 方块")
     return templates
 
+# ============================================
+# 启动基准
+# ============================================
+
+def benchmark_startup(save_name=None, repeat=3, record=True):
+    """冷启动基准: 每个阶段在全新子进程中运行 repeat 次取中位数 (秒)
+    阶段: 导入 mc_builder / info 命令 (只读 level.dat) / 导入 amulet / amulet.load_level
+    record: 结果追加到技能目录下的 startup_bench.jsonl, 便于跟踪变化"""
+    import statistics
+    import subprocess
+    import time
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.join(here, "mc_builder.py")
+    stages = [("import mc_builder", [sys.executable, "-c", f"import sys; sys.path.insert(0, {here!r}); import mc_builder"])]
+    if save_name is not None:
+        stages.append(("info (level.dat)", [sys.executable, script, save_name, "info"]))
+    stages.append(("import amulet", [sys.executable, "-c", "import amulet"]))
+    if save_name is not None:
+        stages.append(("amulet.load_level", [sys.executable, "-c",
+                       f"import sys; sys.path.insert(0, {here!r}); import mc_builder; "
+                       f"mc_builder.open_world({save_name!r}, auto_backup=False).close()"]))
+
+    results = {}
+    for label, cmd in stages:
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            times.append(time.perf_counter() - t0)
+            if proc.returncode != 0:
+                break
+        results[label] = None if proc.returncode != 0 else statistics.median(times)
+    print("启动耗时 (中位数):")
+    for label, t in results.items():
+        print(f"  {label:<20} {'失败' if t is None else f'{t * 1000:.0f} ms'}")
+    if record:
+        path = os.path.join(os.path.dirname(TEMPLATES_DIR), "startup_bench.jsonl")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as f:
+            f.write(json.dumps({"time": datetime.now().isoformat(timespec="seconds"),
+                                "python": sys.version.split()[0], "results": results}) + "\n")
+    return results
+
 # ============================================
 # CLI
 # ============================================
 
+def _print_world_info(info):
+    """info 命令: 只读 level.dat / playerdata, 不导入 amulet"""
+    player = info.player_pos()
+    print(f"存档: {info.level_name} ({info.path})")
+    print(f"版本: {info.version[1]} (DataVersion {info.data_version})")
+    print(f"玩家位置: ({player['x']}, {player['y']}, {player['z']}) 维度: {player['dimension']}")
+    print(f"出生点: {info.spawn}")
+    border = info.world_border
+    print(f"世界边界: 中心 {border['center']}, 大小 {border['size']:.0f}")
+    if info.players:
+        print(f"playerdata: {len(info.players)} 个玩家")
+
 if __name__ == "__main__":
     if len(sys.argv) < 3:
         print("用法: python3 mc_builder.py <save_name_or_path> <command> [args...]")
-        print("命令: info | house | skyscraper | cottage | windmill | farm | dock")
+        print("命令: info | startup | house | skyscraper | cottage | windmill | farm | dock")
         sys.exit(1)
 
-    level, player, dim, ver = quick_setup(sys.argv[1])
     cmd = sys.argv[2]
+    # 只读命令不打开存档, 也不导入 amulet
+    if cmd == "info":
+        _print_world_info(world_info(sys.argv[1]))
+        sys.exit(0)
+    if cmd == "startup":
+        benchmark_startup(sys.argv[1], repeat=int(sys.argv[3]) if len(sys.argv) > 3 else 3)
+        sys.exit(0)
+
+    level, player, dim, ver = quick_setup(sys.argv[1])
     ox = int(sys.argv[3]) if len(sys.argv) > 3 else 5
 
-    if cmd == "info":
-        pass
-    elif cmd == "house":
+    if cmd == "house":
         build_simple_house(level, player["x"]+ox, player["y"], player["z"], dim, ver)
     elif cmd == "skyscraper":
         build_skyscraper(level, player["x"]+ox, player["y"], player["z"], dim, ver)